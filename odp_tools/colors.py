@@ -1,6 +1,5 @@
 import pathlib
 
-from PIL import ImageCms
 import pdfrw
 
 
@@ -8,6 +7,8 @@ class SRGBColorspace:
     """load and properly format the ICC sRGB2014 color profile for embedding in a
 PDF file."""
     def __init__(self):
+        from PIL import ImageCms
+
         # load the sRGB2014 ICC color profile
         iccpath = pathlib.Path(
             __file__).absolute().parent / "icc" / "sRGB2014.icc"
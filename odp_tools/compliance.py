@@ -11,9 +11,6 @@ import pathlib
 
 import pdfrw
 
-from metadata import PDFMetadata
-from colors import SRGBColorspace
-
 
 class MakePDFCompliant:
     @staticmethod
@@ -42,6 +39,12 @@ class MakePDFCompliant:
                             dest="keep_date",
                             default=False,
                             help="keep the CreationDate")
+        parser.add_argument("-l",
+                            "--linearize",
+                            action="store_true",
+                            dest="linearize",
+                            default=False,
+                            help="write a linearized (fast web view) file")
         return parser
 
     def __init__(self, options):
@@ -50,11 +53,8 @@ class MakePDFCompliant:
             # need to parse the pdf date from the string. possible, but I don't
             # need it. I just overwrite with current date.
             raise NotImplementedError()
-        if options.thumbnail is True:
-            # need to extract a thumbnail from the pdf. not super easily done
-            # in PIL (PIL only writes to pdfs. implement when really needed)
-            raise NotImplementedError()
 
+        from colors import SRGBColorspace
         self.srgb = SRGBColorspace()
 
     def run(self):
@@ -72,7 +72,17 @@ class MakePDFCompliant:
             writer.addpage(page)
 
         # (2) extract the Metadata from the /Info dict
+        from metadata import PDFMetadata
         metadata = PDFMetadata(pdfInfo=reader.Info)
+        if self.options.thumbnail:
+            # scanned pages are a single image, so instead of rendering the
+            # first page, its largest image is decoded at reduced scale.
+            from images import get_page_thumbnail
+            thumbnail = get_page_thumbnail(reader.pages[0], (300, 300))
+            if thumbnail is None:
+                print("  no image on the first page, no thumbnail")
+            else:
+                metadata.thumbnail = thumbnail
 
         # (3) add new metadata to the output file and write
         writer.trailer.Info = metadata.pdfInfo()
@@ -80,6 +90,9 @@ class MakePDFCompliant:
         writer.trailer.Root.Metadata = metadata.pdfXMP()
         writer.trailer.Root.OutputIntents = self.srgb.pdfOutputIntent()
         writer.write()
+        if self.options.linearize:
+            from writer import linearize
+            linearize(filepath)
 
         # optionally remove the input
         if not self.options.keep_original:
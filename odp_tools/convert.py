@@ -1,26 +1,30 @@
 # convert pnm scans to reasonably-sized PDFs.
+#
+# the image processing dependencies (noteshrink, sklearn, numpy, pillow,
+# img2pdf) are slow to import, so they are only imported by the code that
+# uses them. that keeps the startup time of the command line tools low.
 
 import multiprocessing
+import concurrent.futures
+import collections
+import threading
+import queue
+import copy
 import argparse
 import io
 import datetime
 import subprocess
 import tempfile
 import os
+import zlib
 from dateutil.tz import tzlocal
 
-import noteshrink
 import yaml
-import img2pdf
-import pdfrw
-import tqdm
-import numpy as np
-from PIL import Image
-from sklearn.cluster import MiniBatchKMeans
 
-from metadata import PDFMetadata
-from metadata import get_thumbnail
-from colors import SRGBColorspace
+# target size mode: JPEG qualities tried for photo-like pages. a page is
+# photo-like if more than PHOTO_FRACTION of it is foreground.
+TARGET_JPEG_QUALITIES = (85, 60, 40)
+PHOTO_FRACTION = 0.5
 
 
 class NumberedThing:
@@ -31,6 +35,81 @@ is a very simple mechanism to to so."""
         self.thing = thing
 
 
+class PageImage:
+    """a page on its way through the pipeline. the stages in this process pass
+the decoded pillow image around (for noteshrink output that is the array of
+palette indices and the palette), the external tools pass PNG data. the page
+is only encoded or decoded when it crosses between the two."""
+    def __init__(self, dpi, image=None, png=None, colors=None):
+        self.dpi = dpi
+        self.image = image
+        self.png = png
+        self.pixels = None
+        # for noteshrink output: the palette as fitted to the scan, before
+        # saturate and white_bg
+        self.colors = colors
+        # in target size mode, several candidates share a page
+        self.lock = threading.Lock()
+
+    def get_image(self):
+        from PIL import Image
+
+        with self.lock:
+            if self.image is None:
+                self.image = Image.open(io.BytesIO(self.png))
+                self.image.load()
+        return self.image
+
+    def get_array(self):
+        import numpy as np
+
+        if self.pixels is None:
+            self.pixels = np.asarray(self.get_image())
+        return self.pixels
+
+    def get_png(self):
+        """PNG data of the page. the tools decode and re-encode the image
+anyway, so it is written with fast compression."""
+        image = self.get_image()
+        with self.lock:
+            if self.png is None:
+                obuf = io.BytesIO()
+                image.save(obuf,
+                           format="PNG",
+                           compress_level=1,
+                           dpi=(self.dpi, self.dpi))
+                self.png = obuf.getvalue()
+        return self.png
+
+    def is_rgb_png(self):
+        """True if the page is PNG data that can be embedded as it is: 8 bit
+RGB, not interlaced."""
+        return self.png is not None and self.png[24:29] == bytes(
+            [8, 2, 0, 0, 0])
+
+
+class TargetSearch:
+    """the candidates of one page in target size mode. every candidate is a
+future of a (pdf bytes, psnr) tuple. result() waits for them and returns the
+pdf of the best candidate: the one with the best quality that fits into the
+budget, otherwise the smallest one that meets the quality floor, otherwise the
+first one, which uses the settings of the profile."""
+    def __init__(self, target_bytes, min_psnr):
+        self.target_bytes = target_bytes
+        self.min_psnr = min_psnr
+        self.candidates = []
+
+    def result(self):
+        results = [c.result() for c in self.candidates]
+        good = [r for r in results if r[1] >= self.min_psnr]
+        fits = [r for r in good if len(r[0]) <= self.target_bytes]
+        if fits:
+            return max(fits, key=lambda r: (r[1], -len(r[0])))[0]
+        if good:
+            return min(good, key=lambda r: len(r[0]))[0]
+        return results[0][0]
+
+
 class HackedNoteShrink:
     """a slightly modfied version of Matt Zucker's noteshrink tool."""
     """
@@ -56,10 +135,18 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
     """
-    def run(self, img):
-        samples = noteshrink.sample_pixels(img, self.options)
-        palette = self.get_palette(samples)
+    def run(self, img, sample_img=None):
+        """shrink 'img'. the palette is fitted to 'sample_img' (default:
+'img'), which can be a larger version of the same page."""
+        import noteshrink
+        import numpy as np
+        from PIL import Image
+
+        if sample_img is None:
+            sample_img = img
+        palette = self.get_palette(sample_img)
         labels = noteshrink.apply_palette(img, palette, self.options)
+        self.colors = palette
 
         if self.options.saturate:
             palette = palette.astype(np.float32)
@@ -76,129 +163,391 @@ SOFTWARE.
         output_img.putpalette(palette.flatten())
         return output_img
 
-    def get_palette(self, samples):
+    def get_samples(self, img):
+        """the pixel samples of 'img'. the sampling is seeded from the image
+content, so that identical scans give identical pages, which the PDFBuilder
+can then store only once."""
+        import noteshrink
+        import numpy as np
+
+        key = ("samples", self.options.sample_fraction)
+        if key not in self.cache:
+            self.cache["seed"] = zlib.crc32(img.data)
+            np.random.seed(self.cache["seed"])
+            self.cache[key] = noteshrink.sample_pixels(img, self.options)
+        return self.cache[key]
+
+    def get_foreground(self, img):
+        """the background color of 'img' and the mask of the samples that are
+foreground. they do not depend on the number of colors, so palettes of
+different sizes share them."""
+        import noteshrink
+
+        o = self.options
+        key = ("foreground", o.sample_fraction, o.value_threshold,
+               o.sat_threshold)
+        if key not in self.cache:
+            samples = self.get_samples(img)
+            bg_color = noteshrink.get_bg_color(samples, 6)
+            fg_mask = noteshrink.get_fg_mask(bg_color, samples, self.options)
+            self.cache[key] = (bg_color, fg_mask)
+        return self.cache[key]
+
+    def get_palette(self, img):
         """this allows some customization for the kmeans algo"""
-        bg_color = noteshrink.get_bg_color(samples, 6)
-
-        fg_mask = noteshrink.get_fg_mask(bg_color, samples, self.options)
+        import numpy as np
+        from sklearn.cluster import MiniBatchKMeans
+
+        o = self.options
+        key = ("palette", o.sample_fraction, o.value_threshold,
+               o.sat_threshold, o.num_colors, o.kmeans_iter,
+               o.kmeans_batch_size)
+        if key in self.cache:
+            return self.cache[key]
+        samples = self.get_samples(img)
+        bg_color, fg_mask = self.get_foreground(img)
 
         # use mini-batch k means from sklearn instead of scipy kmeans
         mbk = MiniBatchKMeans(init="k-means++",
                               n_clusters=self.options.num_colors - 1,
                               max_iter=self.options.kmeans_iter,
                               batch_size=self.options.kmeans_batch_size,
-                              compute_labels=False)
+                              compute_labels=False,
+                              random_state=self.cache["seed"])
         mbk.fit(samples[fg_mask].astype(np.float32))
         centers = mbk.cluster_centers_
 
         palette = np.vstack((bg_color, centers)).astype(np.uint8)
+        self.cache[key] = palette
         return palette
 
-    def __init__(self, options):
+    def __init__(self, options, cache=None):
         self.options = options
+        self.colors = None
+        # samples and palettes of the current page. output profiles of the
+        # same page pass the same cache, so that they are computed only once.
+        self.cache = {} if cache is None else cache
 
-    def shrink(self, imbuf, dpi):
-        # load image using pillow and run noteshrink. noteshrink returns a
-        # pillow image
-        image, _ = noteshrink.load(imbuf)
-        out_image = self.run(image)
-
-        # write the image as optimzed PNG to output buffer
-        pngopts = {"optimize": True, "dpi": (dpi, dpi)}
-        obuf = io.BytesIO()
-        out_image.save(obuf, format="PNG", **pngopts)
-        obuf.seek(0)
-        return obuf
+    def shrink(self, page, sample_page=None):
+        # run noteshrink on the RGB page. noteshrink returns a pillow image,
+        # which is passed on without encoding it
+        sample_img = None if sample_page is None else sample_page.get_array()
+        out_image = self.run(page.get_array(), sample_img)
+        return PageImage(page.dpi, image=out_image, colors=self.colors)
 
 
 class PDFWorker:
-    """take a filename from the queue, process that file, put a bytes array of a
-pdf version of that file on the results queue."""
+    """take a page from the queue, process that page, put bytes arrays of pdf
+versions of that page, one per output profile, on the results queue. a page is
+a (filename, frame) pair, see Options.get_filenames."""
     def __init__(self, work_queue, results_queue, options):
-        # work until there is no more work
+        # work until we get None. checking work_queue.empty() is not enough,
+        # the queue may still be filling up when the worker starts.
         self.options = options
         self.results_queue = results_queue
-        while not work_queue.empty():
-            self.do_work(work_queue.get())
+        # pages whose external-tool stages are still running, oldest first
+        self.pending = collections.deque()
+        depth = max(self.options.general.pipeline_depth, 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=depth) as pool:
+            self.pool = pool
+            while True:
+                try:
+                    work_item = work_queue.get_nowait()
+                except queue.Empty:
+                    # nothing to overlap the pending pages with. finish them
+                    # before waiting, the next page may only be handed out
+                    # once their results are back.
+                    self.drain(0)
+                    work_item = work_queue.get()
+                if work_item is None:
+                    break
+                self.do_work(work_item)
+            self.drain(0)
 
     def do_work(self, work_item):
-        # execute the processing pipeline
-        raw_imbuf = self.load_image(work_item.thing)
-        shrunk_imbuf = self.run_noteshrink(raw_imbuf)
-        quant_imbuf = self.run_pngquant(shrunk_imbuf)
-        opt_imbuf = self.run_optipng(quant_imbuf)
-
-        pdfbuf = self.run_img2pdf(opt_imbuf)
-
+        # execute the processing pipeline. the page is decoded once and
+        # noteshrink shares its samples and palettes between the profiles.
+        # noteshrink runs in this process, the rest of the pipeline mostly
+        # waits on pngquant and optipng, so it is handed to the thread pool
+        # while we shrink the next page.
+        dpis = [p.general.output_dpi for p in self.options.profiles.values()]
+        page = PageImage(max(dpis),
+                         image=self.load_image(*work_item.thing, max(dpis)))
+        scaled = {page.dpi: page}
+        cache = {}
+        futures = {}
+        for name, profile in self.options.profiles.items():
+            dpi = profile.general.output_dpi
+            if dpi not in scaled:
+                scaled[dpi] = PageImage(dpi,
+                                        image=self.scale_image(
+                                            page.image, page.dpi, dpi))
+            if profile.general.target_bytes_per_page:
+                futures[name] = self.search_work(scaled[dpi], profile, page,
+                                                 cache)
+                continue
+            shrunk_page = self.run_noteshrink(scaled[dpi], profile, page,
+                                              cache)
+            futures[name] = self.submit(self.finish_work, shrunk_page,
+                                        profile)
+        if self.options.general.pipeline_depth < 1:
+            self.put_result(
+                work_item.number,
+                {name: f.result()
+                 for name, f in futures.items()})
+            return
+        self.drain(self.options.general.pipeline_depth - 1)
+        self.pending.append((work_item.number, futures))
+
+    def finish_work(self, page, profile):
+        quant_page = self.run_pngquant(page, profile)
+        opt_page = self.run_optipng(quant_page, profile)
+        pdfbuf = self.run_img2pdf(opt_page, profile)
+        return pdfbuf.getvalue()
+
+    def submit(self, fn, *args):
+        """run 'fn' in the thread pool, or right away if pipeline_depth < 1.
+returns a future either way."""
+        if self.options.general.pipeline_depth >= 1:
+            return self.pool.submit(fn, *args)
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+    # target size mode: every page is made with a few candidate settings and
+    # the best one that fits into target_bytes_per_page is kept. the quality
+    # of a candidate is its PSNR against the scan on the foreground pixels,
+    # noteshrink flattens the background on purpose.
+
+    def search_work(self, page, profile, sample_page, cache):
+        """try the candidate settings of 'profile' on 'page'. noteshrink runs
+here, once per number of colors, and shares the samples and the background
+with the other profiles and candidates. the rest of every candidate runs in
+the thread pool. returns a TargetSearch that picks the result."""
+        import noteshrink
+
+        shrinker = HackedNoteShrink(profile.noteshrink, cache)
+        bg_color, fg_mask = shrinker.get_foreground(sample_page.get_array())
+        # PSNR is computed on every second row and column
+        scan = page.get_array()[::2, ::2]
+        mask = noteshrink.get_fg_mask(bg_color, scan, profile.noteshrink)
+        photo = fg_mask.mean() > PHOTO_FRACTION
+
+        search = TargetSearch(profile.general.target_bytes_per_page,
+                              profile.general.min_psnr)
+        shrunk = {}
+        for kind, candidate in self.get_candidates(profile, photo):
+            if kind == "jpeg":
+                search.candidates.append(
+                    self.submit(self.jpeg_work, page, candidate, scan, mask))
+                continue
+            num_colors = candidate.noteshrink.num_colors
+            if num_colors not in shrunk:
+                shrunk[num_colors] = self.run_noteshrink(
+                    page, candidate, sample_page, cache)
+            search.candidates.append(
+                self.submit(self.candidate_work, shrunk[num_colors],
+                            candidate, scan, mask))
+        return search
+
+    def get_candidates(self, profile, photo):
+        """the settings tried in target size mode as ("png", profile) and
+("jpeg", quality) pairs. the settings of the profile come first, then fewer
+colors (down to 2) and a lower pngquant quality. photo-like pages also try
+JPEG."""
+        colors = [profile.noteshrink.num_colors]
+        while profile.noteshrink.enable and colors[-1] > 2:
+            colors.append(max(colors[-1] // 2, 2))
+        qualities = [profile.pngquant.max_quality]
+        if profile.pngquant.enable and qualities[0] > 50:
+            qualities.append(qualities[0] - 40)
+        candidates = []
+        for num_colors in colors:
+            for max_quality in qualities:
+                candidate = copy.copy(profile)
+                candidate.noteshrink = argparse.Namespace(
+                    **vars(profile.noteshrink))
+                candidate.noteshrink.num_colors = num_colors
+                candidate.pngquant = argparse.Namespace(
+                    **vars(profile.pngquant))
+                candidate.pngquant.max_quality = max_quality
+                candidates.append(("png", candidate))
+        if photo:
+            candidates.extend(("jpeg", q) for q in TARGET_JPEG_QUALITIES)
+        return candidates
+
+    def candidate_work(self, page, profile, scan, mask):
+        quant_page = self.run_pngquant(page, profile)
+        psnr = self.get_psnr(quant_page, scan, mask, page)
+        opt_page = self.run_optipng(quant_page, profile)
+        pdfbuf = self.run_img2pdf(opt_page, profile)
+        return pdfbuf.getvalue(), psnr
+
+    def jpeg_work(self, page, quality, scan, mask):
+        """embed the page as JPEG. img2pdf keeps the JPEG data as it is."""
+        import img2pdf
+
+        # pillow keeps the save options on the image, so the candidates can
+        # not save the same image at the same time
+        jpeg = io.BytesIO()
+        page.get_image().copy().save(jpeg,
+                                     format="JPEG",
+                                     quality=quality,
+                                     dpi=(page.dpi, page.dpi))
+        psnr = self.get_psnr(PageImage(page.dpi, png=jpeg.getvalue()), scan,
+                             mask)
+        obuf = io.BytesIO()
+        img2pdf.convert(jpeg.getvalue(), outputstream=obuf)
+        return obuf.getvalue(), psnr
+
+    def get_psnr(self, page, scan, mask, shrunk=None):
+        """PSNR of 'page' against 'scan' on the pixels in 'mask'. saturate
+and white_bg only change the look of a noteshrink palette, so pages made from
+the 'shrunk' noteshrink output are compared in the colors noteshrink fitted to
+the scan."""
+        import numpy as np
+
+        img = page.get_image()
+        colors = None if shrunk is None else shrunk.colors
+        if colors is not None and img.mode == "P":
+            # map every palette entry back to the nearest noteshrink color
+            colors = colors.astype(np.float32)
+            shown = np.asarray(shrunk.image.getpalette(), dtype=np.float32)
+            shown = shown.reshape((-1, 3))[:len(colors)]
+            used = np.asarray(img.getpalette(), dtype=np.float32)
+            used = used.reshape((-1, 3))
+            nearest = ((used[:, None] - shown[None])**2).sum(axis=2).argmin(1)
+            pixels = colors[nearest][np.asarray(img)[::2, ::2]]
+        else:
+            pixels = np.asarray(img.convert("RGB"))[::2, ::2]
+        diff = pixels[mask].astype(np.float32) - scan[mask]
+        mse = float(np.mean(diff * diff)) if diff.size else 0.0
+        return 10 * np.log10(255**2 / max(mse, 1e-10))
+
+    def drain(self, limit):
+        """wait for pending pages until at most 'limit' of them are left."""
+        while len(self.pending) > limit:
+            number, futures = self.pending.popleft()
+            self.put_result(
+                number, {name: f.result()
+                         for name, f in futures.items()})
+
+    def put_result(self, number, pdfs):
         # check the processed file into the results queue
-        output = NumberedThing(work_item.number, pdfbuf.getvalue())
-        self.results_queue.put(output)
-
-    def load_image(self, filename):
-        with open(filename, "rb") as ifl:
-            return io.BytesIO(ifl.read())
-
-    # the work functions below all take a BytesIO as an input and return a
-    # BytesIO as output. that way I can chain them and disable a step in the
-    # pipeline if needed
-
-    def run_noteshrink(self, imbuf):
-        if not self.options.noteshrink.enable:
-            return imbuf
-        noteshrink = HackedNoteShrink(self.options.noteshrink)
-        return noteshrink.shrink(imbuf, self.options.general.dpi)
-
-    def run_pngquant(self, imbuf):
-        if not self.options.pngquant.enable:
-            return imbuf
+        self.results_queue.put(NumberedThing(number, pdfs))
+
+    def load_image(self, filename, frame, dpi):
+        """decode the scan as RGB at 'dpi'. if that is lower than the scan
+resolution, the image is scaled before anything else touches it, so that all
+later stages work on fewer pixels. for multi-page files, only 'frame' is
+decoded."""
+        from images import open_page
+
+        img = open_page(filename, frame)
+        input_dpi = self.options.general.input_dpi
+        if dpi != input_dpi:
+            size = self.scaled_size(img, input_dpi, dpi)
+            # JPEGs can be reduced by a power of two while decoding
+            img.draft("RGB", size)
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            img = self.scale_image(img, None, dpi, size)
+        return img.convert("RGB") if img.mode != "RGB" else img
+
+    def scaled_size(self, img, from_dpi, to_dpi):
+        scale = to_dpi / from_dpi
+        return (max(round(img.width * scale), 1),
+                max(round(img.height * scale), 1))
+
+    def scale_image(self, img, from_dpi, to_dpi, size=None):
+        from PIL import Image
+
+        if size is None:
+            size = self.scaled_size(img, from_dpi, to_dpi)
+        # box filter: every output pixel is the mean of the area it covers
+        return img.resize(size, Image.BOX)
+
+    # the work functions below take the options of one output profile. from
+    # noteshrink on they take a PageImage as an input and return a PageImage
+    # as output. that way I can chain them and disable a step in the pipeline
+    # if needed. the page is encoded only for the external tools and once at
+    # the end.
+
+    def run_noteshrink(self, page, profile, sample_page, cache):
+        if not profile.noteshrink.enable:
+            return page
+        noteshrink = HackedNoteShrink(profile.noteshrink, cache)
+        return noteshrink.shrink(page, sample_page)
+
+    def run_pngquant(self, page, profile):
+        if not profile.pngquant.enable:
+            return page
         cmd = [
-            self.options.pngquant.path,
-            "--speed={:d}".format(self.options.pngquant.speed),
-            "--quality=0-{:d}".format(self.options.pngquant.max_quality), "-"
+            profile.pngquant.path,
+            "--speed={:d}".format(profile.pngquant.speed),
+            "--quality=0-{:d}".format(profile.pngquant.max_quality), "-"
         ]
         cp = subprocess.run(cmd,
-                            input=imbuf.getbuffer(),
+                            input=page.get_png(),
                             capture_output=True,
                             check=True)
-        return io.BytesIO(cp.stdout)
+        return PageImage(page.dpi, png=cp.stdout)
 
-    def run_optipng(self, imbuf):
-        if not self.options.optipng.enable:
-            return imbuf
+    def run_optipng(self, page, profile):
+        if not profile.optipng.enable:
+            return page
         with tempfile.TemporaryDirectory() as tempdir:
             inpath = os.path.join(tempdir, "in")
             opath = os.path.join(tempdir, "out")
             # dump image to disk
             with open(inpath, "wb") as inf:
-                inf.write(imbuf.read())
+                inf.write(page.get_png())
 
             # run optipng
             opts = ["-out={:s}".format(opath), "--"]
-            cmd = [self.options.optipng.path] + opts + [inpath]
+            cmd = [profile.optipng.path] + opts + [inpath]
             subprocess.run(cmd, check=True, capture_output=True)
             with open(opath, "rb") as of:
-                return io.BytesIO(of.read())
+                return PageImage(page.dpi, png=of.read())
 
-    def run_img2pdf(self, imbuf):
+    def run_img2pdf(self, page, profile):
         """embed the image in a PDF file."""
-        # first need to convert the png to RGB, otherwise pdfrw will complain
-        rgb_imbuf = io.BytesIO()
-        pngopts = {
-            "format": "PNG",
-            "optimize": True,
-            "dpi": (self.options.general.dpi, self.options.general.dpi)
-        }
-        Image.open(imbuf).convert("RGB").save(rgb_imbuf, **pngopts)
-        rgb_imbuf.seek(0)
+        import img2pdf
+
+        # need RGB, otherwise pdfrw will complain. this is the one place where
+        # the page is encoded for good, unless the tools already wrote an RGB
+        # PNG.
+        if page.is_rgb_png():
+            rgb_png = page.png
+        else:
+            image = page.get_image()
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            rgb_imbuf = io.BytesIO()
+            image.save(rgb_imbuf,
+                       format="PNG",
+                       optimize=True,
+                       dpi=(page.dpi, page.dpi))
+            rgb_png = rgb_imbuf.getvalue()
         obuf = io.BytesIO()
-        img2pdf.convert(rgb_imbuf, outputstream=obuf)
+        img2pdf.convert(rgb_png, outputstream=obuf)
         return obuf
 
 
 class PDFBuilder:
-    """wait for the processing of all pages and construct the output pdf."""
-    def __init__(self, options):
+    """wait for the processing of all pages and construct the output pdf.
+identical page images are stored once, pass 'images' to share them between
+several documents."""
+    def __init__(self, options, images=None):
+        from metadata import PDFMetadata
+        from metadata import get_thumbnail
+        from colors import SRGBColorspace
+        from images import ImageIndex
+
         self.options = options
+        if images is None and self.options.general.dedup:
+            images = ImageIndex()
+        self.images = images
         self.metadata = PDFMetadata(
             title=self.options.metadata.title,
             author=self.options.metadata.author,
@@ -207,22 +556,29 @@ class PDFBuilder:
             creator=self.options.metadata.creator,
         )
         if self.options.metadata.thumbnail:
-            self.metadata.thumbnail = get_thumbnail(self.options.filenames[0],
-                                                    (300, 300))
+            filename, frame = self.options.pages[0]
+            self.metadata.thumbnail = get_thumbnail(filename, (300, 300),
+                                                    frame)
         self.colorspace = SRGBColorspace()
 
-    def run(self, results_queue, remaining):
+    def run(self, results_queue, remaining, position=0):
+        import tqdm
+
         self.remaining = remaining
         self.results_buffer = []
         self.last_written = -1
         self.pdf = None
         with tqdm.tqdm(total=self.remaining,
-                       desc="processing images...") as pbar:
+                       desc="processing images...",
+                       position=position) as pbar:
             while self.remaining > 0:
                 result = results_queue.get()
                 self.process_result(result)
                 self.remaining = self.remaining - 1
                 pbar.update()
+        if self.options.general.linearize:
+            from writer import linearize
+            linearize(self.options.general.pdfname)
 
     def process_result(self, numbered_work_output):
         self.rbuffer_add(numbered_work_output)
@@ -238,9 +594,13 @@ class PDFBuilder:
         return sorted(tlist) == list(range(min(tlist), max(tlist) + 1))
 
     def append_pdf(self):
+        import pdfrw
+
         for item in self.results_buffer:
             # pull the new page out of the work item
             newpage = pdfrw.PdfReader(fdata=item.thing, verbose=False).pages[0]
+            if self.images is not None:
+                self.images.dedup_page(newpage)
 
             # if necessary, create the output pdf
             if self.pdf is None:
@@ -274,23 +634,108 @@ class PDFBuilder:
         return dt.strftime(fmt)
 
 
+class PDFBuilderThreads:
+    """one builder per output profile. each builder writes its pdf in its own
+thread. put() hands a worker result to the builders. if a builder fails, the
+others go on, and join() raises its exception at the end."""
+    def __init__(self, options, remaining):
+        self.queues = {}
+        self.threads = []
+        # profile name -> exception of the builder
+        self.errors = {}
+        for position, (name, profile) in enumerate(options.profiles.items()):
+            self.queues[name] = queue.Queue()
+            builder = PDFBuilder(profile)
+            # a job that fails before all pages are done does not wait for
+            # the builders
+            thread = threading.Thread(target=self.build,
+                                      args=(name, builder, remaining,
+                                            position),
+                                      daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def build(self, name, builder, remaining, position):
+        try:
+            builder.run(self.queues[name], remaining, position)
+        except Exception as e:
+            self.errors[name] = e
+
+    def put(self, result):
+        for name, pdfbytes in result.thing.items():
+            # nobody reads the queue of a failed builder
+            if name not in self.errors:
+                self.queues[name].put(NumberedThing(result.number, pdfbytes))
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        for name, e in self.errors.items():
+            raise RuntimeError("Could not write the PDF of profile "
+                               "{:s}".format(name)) from e
+
+
 class PDFWorkQueue:
     def __init__(self, options):
         # use the options in this object later
         self.options = options
 
-        # create a work queue and a results queue
+        # create a work queue and a results queue. the pages are put on the
+        # work queue by dispatch()
+        self.todo = collections.deque(
+            NumberedThing(number, page)
+            for number, page in enumerate(options.pages))
         self.work_queue = multiprocessing.Queue()
-        for number, filename in enumerate(options.filenames):
-            self.work_queue.put(NumberedThing(number, filename))
         self.results_queue = multiprocessing.Queue()
-
-    def run(self):
-        if self.options.general.nworkers < 1:
+        self.stopping = False
+
+        # with nworkers: auto, the number of workers and the pace at which
+        # pages are handed out depend on the memory the pages need
+        self.budget = None
+        self.nworkers = options.general.nworkers
+        if self.nworkers == "auto":
+            import memory
+            self.budget = memory.MemoryBudget(options)
+            self.nworkers = self.budget.get_nworkers()
+
+    def dispatch(self, in_flight):
+        """put pages on the work queue and return the number of pages that are
+handed out but not finished. with a fixed number of workers, all pages go on
+the queue at once. in auto mode, at most one page per worker waits in the
+queue, and pages are held back while the memory is too tight for them. a page
+is always handed out when none is in flight, so the job keeps going."""
+        # a worker holds the page it shrinks and up to pipeline_depth pages
+        # waiting for the external tools
+        in_workers = self.nworkers * (
+            max(self.options.general.pipeline_depth, 1) + 1)
+        while self.todo:
+            if self.budget is not None and in_flight > 0:
+                nqueued = max(in_flight - in_workers, 0)
+                if (nqueued >= self.nworkers
+                        or not self.budget.can_dispatch(nqueued)):
+                    break
+            self.work_queue.put(self.todo.popleft())
+            in_flight = in_flight + 1
+        if not self.todo and not self.stopping:
+            # one None per worker tells the workers to stop
+            for _ in range(self.nworkers):
+                self.work_queue.put(None)
+            self.stopping = True
+        return in_flight
+
+    def run(self, builders=None):
+        """process all pages. the results go to one PDFBuilder per profile,
+or to 'builders', which needs put() and join() like PDFBuilderThreads."""
+        from images import read_pdf
+
+        if self.nworkers < 1:
             raise RuntimeError("Need workers")
+        # do not share an open input PDF with the workers
+        read_pdf.cache_clear()
+        in_flight = self.dispatch(0)
         # start the workers
         self.procs = []
-        for _ in range(self.options.general.nworkers):
+        for _ in range(self.nworkers):
             proc = multiprocessing.Process(target=PDFWorker,
                                            args=(self.work_queue,
                                                  self.results_queue,
@@ -298,13 +743,35 @@ class PDFWorkQueue:
             self.procs.append(proc)
             proc.start()
 
-        # run the consumer
-        builder = PDFBuilder(self.options)
-        builder.run(self.results_queue, len(self.options.filenames))
-
-        # end the workers after the work is done
-        for proc in self.procs:
-            proc.join()
+        # run the consumers, this thread hands out the results.
+        remaining = len(self.options.pages)
+        if builders is None:
+            builders = PDFBuilderThreads(self.options, remaining)
+        for _ in range(remaining):
+            builders.put(self.results_queue.get())
+            in_flight = self.dispatch(in_flight - 1)
+        try:
+            builders.join()
+        finally:
+            # end the workers after the work is done
+            for proc in self.procs:
+                proc.join()
+
+
+def page_count(value):
+    """argparse type: a number of pages, at least 1."""
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError("need at least one page")
+    return n
+
+
+def scale_factor(value):
+    """argparse type: a scale factor in (0, 1]."""
+    scale = float(value)
+    if not 0 < scale <= 1:
+        raise argparse.ArgumentTypeError("must be in (0, 1]")
+    return scale
 
 
 class Options:
@@ -321,16 +788,47 @@ class Options:
                             metavar="IMAGE",
                             nargs="+",
                             help="files to convert")
+        parser.add_argument("--listen",
+                            metavar="HOST:PORT",
+                            help="let convert-worker processes on other "
+                            "machines do the work")
+        parser.add_argument("--task-timeout",
+                            metavar="SECONDS",
+                            type=float,
+                            help="with --listen, hand the pages of a worker "
+                            "that has not answered for this long to the "
+                            "others (default: 600)")
+        parser.add_argument("--preview",
+                            metavar="PDF",
+                            help="only process a sample of the pages at "
+                            "reduced resolution, write their thumbnails to "
+                            "PDF and estimate the size and time of the job")
+        parser.add_argument("--preview-pages",
+                            type=page_count,
+                            default=8,
+                            help="number of pages in the preview")
+        parser.add_argument("--preview-scale",
+                            type=scale_factor,
+                            default=0.5,
+                            help="resolution of the preview pages relative "
+                            "to output_dpi")
         return parser
 
     def __init__(self, ns):
         # these are the members we want to fill
         self.filenames = None
+        self.pages = None
         self.general = None
         self.metadata = None
         self.noteshrink = None
         self.pngquant = None
         self.optipng = None
+        self.profiles = None
+        self.listen = ns.listen
+        self.task_timeout = ns.task_timeout
+        self.preview = ns.preview
+        self.preview_pages = ns.preview_pages
+        self.preview_scale = ns.preview_scale
 
         # properly load all filenames
         self.get_filenames(ns.filenames)
@@ -343,13 +841,28 @@ class Options:
         self.load_options_from_file(infile, "pngquant")
         self.load_options_from_file(infile, "optipng")
 
+        # the scan and output resolutions default to general.dpi
+        if self.general.input_dpi is None:
+            self.general.input_dpi = self.general.dpi
+        if self.general.output_dpi is None:
+            self.general.output_dpi = self.general.dpi
+
+        self.load_profiles_from_file(infile)
+
     def load_options_from_file(self, filename, optname):
         # some default options
         defaults = {
             "general": {
                 "pdfname": "out.pdf",
                 "dpi": 300,
+                "input_dpi": None,
+                "output_dpi": None,
                 "nworkers": 2,
+                "pipeline_depth": 2,
+                "dedup": True,
+                "linearize": False,
+                "target_bytes_per_page": None,
+                "min_psnr": 25,
             },
             "metadata": {
                 "title": "A Scanned Document",
@@ -395,19 +908,72 @@ class Options:
         # save ns to options object
         setattr(self, optname, ns)
 
+    def load_profiles_from_file(self, filename):
+        """every output profile is a copy of these options with some values
+replaced, for example:
+
+profiles:
+  archival:
+    general: {pdfname: archival.pdf}
+  web:
+    general: {pdfname: web.pdf, dpi: 150}
+    noteshrink: {num_colors: 4}
+
+without profiles, the options themselves are the only profile."""
+        with open(filename) as ifl:
+            d = yaml.load(ifl, Loader=yaml.FullLoader)
+        if not d.get("profiles"):
+            self.profiles = {"default": self}
+            return
+        self.profiles = {}
+        for name, overrides in d["profiles"].items():
+            profile = copy.copy(self)
+            for optname, values in (overrides or {}).items():
+                ns = argparse.Namespace(**vars(getattr(self, optname)))
+                for k, v in values.items():
+                    setattr(ns, k, v)
+                setattr(profile, optname, ns)
+            # general.dpi of a profile is the default of its output_dpi. the
+            # input_dpi was resolved from the global dpi.
+            general = (overrides or {}).get("general") or {}
+            if "dpi" in general and "output_dpi" not in general:
+                profile.general.output_dpi = profile.general.dpi
+            # the pages are decoded and scheduled once for all profiles
+            for k in ("input_dpi", "nworkers", "pipeline_depth"):
+                if getattr(profile.general, k) != getattr(self.general, k):
+                    raise RuntimeError(
+                        "general.{:s} can not be set per profile".format(k))
+            self.profiles[name] = profile
+        pdfnames = [p.general.pdfname for p in self.profiles.values()]
+        if len(set(pdfnames)) != len(pdfnames):
+            raise RuntimeError("Profiles need different pdfnames")
+
     def get_filenames(self, filenames):
+        """sort the input files and list their pages. a multi-page TIFF or a
+PDF has one (filename, frame) pair per page, a single image has frame None.
+only the headers are read here, the workers decode their own frame."""
+        import noteshrink
+        from images import get_pages
+        from images import read_pdf
+
         o = argparse.Namespace()
         o.sort_numerically = True
         o.filenames = filenames
         self.filenames = noteshrink.get_filenames(o)
+        self.pages = [p for fn in self.filenames for p in get_pages(fn)]
+        # the workers open the PDFs themselves
+        read_pdf.cache_clear()
 
     def __str__(self):
         return """Options:
  nfiles: {:d}
+ npages: {:d}
  general: {:s}
  metadata: {:s}
  noteshrink: {:s}
  pngquant: {:s}
- optipng: {:s}""".format(len(self.filenames), str(self.general),
-                         str(self.metadata), str(self.noteshrink),
-                         str(self.pngquant), str(self.optipng))
+ optipng: {:s}
+ profiles: {:s}""".format(len(self.filenames), len(self.pages),
+                          str(self.general), str(self.metadata),
+                          str(self.noteshrink), str(self.pngquant),
+                          str(self.optipng), ", ".join(self.profiles))
@@ -0,0 +1,380 @@
+# share identical page images between the pages of generated PDFs, get the
+# images back out of PDF pages and open the pages of multi-page input files.
+
+import functools
+import hashlib
+import struct
+import zlib
+import io
+
+import pdfrw
+
+
+class ImageIndex:
+    """remember image XObjects by a hash of their content. pages whose images
+have been seen before are pointed at the existing object, so every distinct
+image is written only once. one index can be shared by several documents."""
+    def __init__(self):
+        self.objects = {}
+        self.nshared = 0
+
+    def digest(self, obj, memo=None):
+        """hash a PDF object including everything it references. for streams
+this covers the dictionary (size, filters, colorspace, ...) and the data."""
+        memo = {} if memo is None else memo
+        objid = id(obj)
+        if objid in memo:
+            return memo[objid]
+        h = hashlib.sha256()
+        if isinstance(obj, pdfrw.PdfDict):
+            h.update(b"<<")
+            for key in sorted(obj.keys()):
+                if key == "/Length":
+                    continue
+                h.update(key.encode("latin-1"))
+                h.update(self.digest(obj[key], memo))
+            h.update(b">>")
+            if obj.stream is not None:
+                h.update(obj.stream.encode("latin-1"))
+        elif isinstance(obj, pdfrw.PdfArray):
+            h.update(b"[")
+            for item in obj:
+                h.update(self.digest(item, memo))
+            h.update(b"]")
+        else:
+            h.update(str(obj).encode("latin-1"))
+        memo[objid] = h.digest()
+        return memo[objid]
+
+    def share(self, xobj):
+        """return the known object with the same content as 'xobj'. if there is
+none, remember 'xobj' and return it."""
+        known = self.objects.setdefault(self.digest(xobj), xobj)
+        if known is not xobj:
+            self.nshared = self.nshared + 1
+        return known
+
+    def dedup_page(self, page):
+        """point the image XObjects of 'page' at shared objects."""
+        resources = page.inheritable.Resources
+        if resources is None or resources.XObject is None:
+            return
+        xobjects = resources.XObject
+        for name in list(xobjects.keys()):
+            xobj = xobjects[name]
+            if xobj.Subtype == pdfrw.PdfName.Image:
+                xobjects[name] = self.share(xobj)
+
+
+# colorspace -> (pillow mode, PNG color type) for 8 bit images
+COLORSPACES = {
+    1: ("L", 0),
+    3: ("RGB", 2),
+    4: ("CMYK", None),
+}
+
+
+def get_largest_image(page):
+    """return the image XObject of 'page' with the most pixels, or None."""
+    resources = page.inheritable.Resources
+    if resources is None or resources.XObject is None:
+        return None
+    images = [
+        x for x in resources.XObject.values()
+        if x.Subtype == pdfrw.PdfName.Image
+    ]
+    if not images:
+        return None
+    return max(images, key=lambda x: int(x.Width) * int(x.Height))
+
+
+def get_colorspace(xobj):
+    """return the number of components and the palette (or None) of an
+image XObject."""
+    cs = xobj.ColorSpace
+    if isinstance(cs, pdfrw.PdfArray) and cs[0] == "/Indexed":
+        ncomp, _ = get_colorspace(pdfrw.PdfDict(ColorSpace=cs[1]))
+        lookup = cs[3]
+        if isinstance(lookup, pdfrw.PdfDict):
+            lookup = lookup.stream.encode("latin-1")
+        else:
+            lookup = lookup.to_bytes()
+        if ncomp == 1:
+            lookup = bytes(b for b in lookup for _ in range(3))
+        elif ncomp != 3:
+            return 0, None
+        return 1, lookup
+    if isinstance(cs, pdfrw.PdfArray) and cs[0] == "/ICCBased":
+        return int(cs[1].N or 0), None
+    if isinstance(cs, pdfrw.PdfArray):
+        # CalGray and CalRGB are gray and RGB with calibration data
+        return {"/CalGray": 1, "/CalRGB": 3}.get(cs[0], 0), None
+    ncomp = {"/DeviceGray": 1, "/DeviceRGB": 3, "/DeviceCMYK": 4}.get(cs, 0)
+    return ncomp, None
+
+
+def png_from_flate(xobj, ncomp, palette, data):
+    """wrap Flate data with PNG predictors in a PNG file. the predictors are
+the PNG row filters, so pillow can decode the stream as it is."""
+    def chunk(name, payload):
+        crc = zlib.crc32(name + payload)
+        return struct.pack(">I", len(payload)) + name + payload + struct.pack(
+            ">I", crc)
+
+    bpc = int(xobj.BitsPerComponent or 8)
+    color_type = 3 if palette is not None else COLORSPACES[ncomp][1]
+    ihdr = struct.pack(">IIBBBBB", int(xobj.Width), int(xobj.Height), bpc,
+                       color_type, 0, 0, 0)
+    png = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr)
+    if palette is not None:
+        png = png + chunk(b"PLTE", palette)
+    return png + chunk(b"IDAT", data) + chunk(b"IEND", b"")
+
+
+def decode_image(xobj, size=None):
+    """decode an image XObject with pillow. if 'size' is given, the image is
+decoded at a reduced scale that is still at least that large where the format
+allows it: JPEGs use draft mode, unfiltered Flate images are decoded with a
+stride. returns None for unsupported images."""
+    from PIL import Image
+    import numpy as np
+
+    filters = xobj.Filter
+    if not isinstance(filters, pdfrw.PdfArray):
+        filters = [] if filters is None else [filters]
+    # with an array of filters, there is an array of parameters
+    parms = xobj.DecodeParms
+    if isinstance(parms, pdfrw.PdfArray):
+        parms = parms[0] if len(parms) == 1 else None
+    if not isinstance(parms, pdfrw.PdfDict):
+        parms = pdfrw.PdfDict()
+    data = xobj.stream.encode("latin-1")
+    width, height = int(xobj.Width), int(xobj.Height)
+    # integer reduction factor that keeps the image at least 'size'
+    step = 1
+    if size is not None:
+        step = max(min(width // size[0], height // size[1]), 1)
+
+    if filters == ["/DCTDecode"]:
+        img = Image.open(io.BytesIO(data))
+        if size is not None:
+            img.draft("RGB", (width // step, height // step))
+        return img
+
+    if filters not in (["/FlateDecode"], []):
+        return None
+    ncomp, palette = get_colorspace(xobj)
+    if ncomp not in COLORSPACES:
+        return None
+    bpc = int(xobj.BitsPerComponent or 8)
+    predictor = int(parms.Predictor or 1)
+    if predictor >= 10:
+        # every row depends on the previous one, so all rows are decoded
+        if COLORSPACES[ncomp][1] is None:
+            return None
+        img = Image.open(io.BytesIO(png_from_flate(xobj, ncomp, palette,
+                                                   data)))
+        return img.reduce(step) if step > 1 else img
+    if predictor != 1 or bpc != 8:
+        return None
+
+    raw = zlib.decompress(data) if filters else data
+    pixels = np.frombuffer(raw, dtype=np.uint8, count=width * height * ncomp)
+    pixels = pixels.reshape((height, width, ncomp))[::step, ::step]
+    if palette is not None:
+        img = Image.fromarray(np.ascontiguousarray(pixels[:, :, 0]), "P")
+        img.putpalette(palette)
+        return img
+    if ncomp == 1:
+        pixels = pixels[:, :, 0]
+    return Image.fromarray(np.ascontiguousarray(pixels),
+                           COLORSPACES[ncomp][0])
+
+
+def get_page_thumbnail(page, size):
+    """return a thumbnail of the largest image on 'page' without rendering the
+page, or None if there is no image that can be decoded."""
+    xobj = get_largest_image(page)
+    if xobj is None:
+        return None
+    img = decode_image(xobj, size)
+    if img is None:
+        return None
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    img.thumbnail(size)
+    return img
+
+
+# input files for convert-scans. a file is either a single image, a multi-page
+# image (TIFF) or a PDF with one scanned image per page. the pages are
+# addressed as (filename, frame), frame is None for single images.
+#
+# input PDFs can be hundreds of MB. pikepdf (qpdf) reads the objects of a PDF
+# from the file when they are used, so only the image of the page at hand is
+# read. only that image is converted to a pdfrw object for decode_image.
+# without pikepdf, pdfrw reads the whole file.
+
+
+def is_pdf(filename):
+    with open(filename, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def reads_whole_pdf():
+    """True if input PDFs are read into memory as a whole (no pikepdf)."""
+    try:
+        import pikepdf  # noqa: F401
+    except ImportError:
+        return True
+    return False
+
+
+@functools.lru_cache(maxsize=1)
+def read_pdf(filename):
+    """the pages of one input file usually come one after the other, so the
+last PDF is kept open. with pikepdf, that is an open file: clear the cache
+before forking, the processes would share its file offset."""
+    try:
+        import pikepdf
+    except ImportError:
+        return pdfrw.PdfReader(filename, verbose=False)
+    return pikepdf.open(filename)
+
+
+def get_pikepdf_images(page):
+    """the image XObjects of a pikepdf page. the resources can be inherited
+from the page tree."""
+    import pikepdf
+
+    node = page.obj
+    while node is not None and "/Resources" not in node:
+        node = node.get("/Parent")
+    if node is None:
+        return []
+    xobjects = node.Resources.get("/XObject")
+    if xobjects is None:
+        return []
+    return [
+        x for _, x in xobjects.items()
+        if isinstance(x, pikepdf.Stream)
+        and x.get("/Subtype") == pikepdf.Name.Image
+    ]
+
+
+def pdfrw_from_pikepdf(obj, memo=None):
+    """copy a pikepdf object and everything it references to pdfrw objects.
+streams keep their encoded data."""
+    import pikepdf
+
+    memo = {} if memo is None else memo
+    if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+        if obj.objgen in memo:
+            return memo[obj.objgen]
+    if isinstance(obj, pikepdf.Name):
+        return pdfrw.PdfName(str(obj)[1:])
+    if isinstance(obj, pikepdf.String):
+        return pdfrw.PdfString.from_bytes(bytes(obj))
+    if isinstance(obj, pikepdf.Array):
+        return pdfrw.PdfArray([pdfrw_from_pikepdf(x, memo) for x in obj])
+    if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        copy = pdfrw.PdfDict()
+        if obj.is_indirect:
+            memo[obj.objgen] = copy
+        for key, value in obj.items():
+            copy[pdfrw.PdfName(key[1:])] = pdfrw_from_pikepdf(value, memo)
+        if isinstance(obj, pikepdf.Stream):
+            copy.stream = obj.read_raw_bytes().decode("latin-1")
+        return copy
+    if isinstance(obj, bool):
+        return pdfrw.PdfObject("true" if obj else "false")
+    return obj
+
+
+def get_pages(filename):
+    """list the pages of an input file as (filename, frame) pairs. only the
+image headers or the page tree are read, no page is decoded."""
+    from PIL import Image
+
+    if is_pdf(filename):
+        npages = len(read_pdf(filename).pages)
+        return [(filename, frame) for frame in range(npages)]
+    with Image.open(filename) as img:
+        nframes = getattr(img, "n_frames", 1)
+    if nframes == 1:
+        return [(filename, None)]
+    return [(filename, frame) for frame in range(nframes)]
+
+
+def get_page_image(filename, frame):
+    """the image XObject of page 'frame' of the PDF 'filename', as a pikepdf
+or a pdfrw object."""
+    pdf = read_pdf(filename)
+    if isinstance(pdf, pdfrw.PdfReader):
+        xobj = get_largest_image(pdf.pages[frame])
+    else:
+        images = get_pikepdf_images(pdf.pages[frame])
+        xobj = max(images,
+                   key=lambda x: int(x.Width) * int(x.Height),
+                   default=None)
+    if xobj is None:
+        raise RuntimeError("Page {:d} of {:s} has no usable image".format(
+            frame + 1, filename))
+    return xobj
+
+
+def get_page_jpeg(filename, frame):
+    """the data of page 'frame' of the PDF 'filename' if its image is a plain
+JPEG, which pillow opens as it is, like decode_image does. None otherwise."""
+    if not is_pdf(filename):
+        return None
+    xobj = get_page_image(filename, frame)
+    if isinstance(xobj, pdfrw.PdfDict):
+        filters = xobj.Filter
+        array = pdfrw.PdfArray
+    else:
+        import pikepdf
+        filters = xobj.get("/Filter")
+        array = pikepdf.Array
+    if not isinstance(filters, array):
+        filters = [] if filters is None else [filters]
+    if [str(f) for f in filters] != ["/DCTDecode"]:
+        return None
+    if isinstance(xobj, pdfrw.PdfDict):
+        return xobj.stream.encode("latin-1")
+    return xobj.read_raw_bytes()
+
+
+def open_page(filename, frame):
+    """open one page of an input file. like Image.open, the pixels are not
+decoded until they are used, and only this frame is decoded."""
+    from PIL import Image
+
+    if frame is None:
+        return Image.open(filename)
+    if is_pdf(filename):
+        xobj = get_page_image(filename, frame)
+        try:
+            if not isinstance(xobj, pdfrw.PdfDict):
+                xobj = pdfrw_from_pikepdf(xobj)
+            img = decode_image(xobj)
+        except (ValueError, TypeError, AttributeError, KeyError, IndexError,
+                OSError, zlib.error):
+            # broken or unusual image data
+            img = None
+        if img is None:
+            raise RuntimeError("Page {:d} of {:s} has no usable image".format(
+                frame + 1, filename))
+        return img
+    img = Image.open(filename)
+    img.seek(frame)
+    return img
+
+
+def get_page_size(filename, frame):
+    """width and height of one page of an input file, from the headers."""
+    if frame is not None and is_pdf(filename):
+        xobj = get_page_image(filename, frame)
+        return (int(xobj.Width), int(xobj.Height))
+    with open_page(filename, frame) as img:
+        return img.size
@@ -0,0 +1,114 @@
+# pick the number of convert-scans workers from the size of the pages, the
+# free memory and the number of CPUs, and hold pages back while memory is
+# tight.
+#
+# the page sizes come from the image headers, nothing is decoded. the numbers
+# below were measured with a 300 dpi letter page (8.4 megapixels): a worker
+# with all libraries loaded uses about 150 MB, processing one page adds about
+# 29 bytes per output pixel on top of that (RGB page, noteshrink's float
+# arrays, the palette image and the PNG buffers), BYTES_PER_PIXEL rounds that
+# up to 32. a page that waits for pngquant and optipng is a palette image, one
+# byte per pixel for every profile.
+
+import os
+
+# resident memory of an idle worker
+WORKER_BYTES = 150 * 2**20
+# peak memory per pixel of the output page while it is processed
+BYTES_PER_PIXEL = 32
+# peak memory per pixel of the scan while it is decoded and scaled
+DECODE_BYTES_PER_PIXEL = 4
+# memory left to the rest of the system
+RESERVE_BYTES = 256 * 2**20
+# number of image headers read to find the largest page
+MAX_SAMPLES = 16
+# without pikepdf, a worker reads an input PDF as a whole. pdfrw keeps the
+# file and the parsed objects, up to twice the file size.
+PDF_BYTES_PER_BYTE = 2
+
+
+def available_memory():
+    """MemAvailable from /proc/meminfo in bytes, or None if it is unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def cpu_count():
+    """number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_page_pixels(pages):
+    """largest number of pixels of the (filename, frame) 'pages'. only the
+headers of at most MAX_SAMPLES evenly spaced pages are read."""
+    from images import get_page_size
+
+    step = max(len(pages) // MAX_SAMPLES, 1)
+    pixels = 0
+    for filename, frame in pages[::step][:MAX_SAMPLES]:
+        width, height = get_page_size(filename, frame)
+        pixels = max(pixels, width * height)
+    return pixels
+
+
+def get_container_bytes(pages):
+    """memory a worker needs to hold the largest input PDF of 'pages' while
+it decodes one of its pages. 0 with pikepdf, which reads only that page."""
+    from images import is_pdf
+    from images import reads_whole_pdf
+
+    if not reads_whole_pdf():
+        return 0
+    filenames = {filename for filename, frame in pages if frame is not None}
+    sizes = [os.path.getsize(fn) for fn in filenames if is_pdf(fn)]
+    return max(sizes, default=0) * PDF_BYTES_PER_BYTE
+
+
+class MemoryBudget:
+    """estimate the memory a page needs in a worker and decide how many
+workers to run and when to hand out the next page."""
+    def __init__(self, options):
+        general = options.general
+        input_pixels = get_page_pixels(options.pages)
+        dpis = [p.general.output_dpi for p in options.profiles.values()]
+        scale = (max(dpis) / general.input_dpi)**2
+        # the page at the highest output resolution while it is processed,
+        # plus up to 'depth' pages waiting for the external tools, which cost
+        # one byte per pixel and profile as palette images
+        output_pixels = input_pixels * scale
+        nprofiles = len(options.profiles)
+        depth = max(general.pipeline_depth, 1)
+        self.page_bytes = int(output_pixels *
+                              (BYTES_PER_PIXEL + nprofiles * depth) +
+                              input_pixels * DECODE_BYTES_PER_PIXEL +
+                              get_container_bytes(options.pages))
+
+    def get_nworkers(self):
+        """as many workers as there are CPUs, but no more than fit into the
+available memory. at least one."""
+        nworkers = cpu_count()
+        available = available_memory()
+        if available is not None:
+            fit = (available - RESERVE_BYTES) // (WORKER_BYTES +
+                                                  self.page_bytes)
+            nworkers = min(nworkers, fit)
+        return max(nworkers, 1)
+
+    def can_dispatch(self, nqueued):
+        """True if there is memory for another page on top of the 'nqueued'
+pages that have been handed out but not started yet. the pages the workers
+are processing already show up in the available memory."""
+        available = available_memory()
+        if available is None:
+            return True
+        needed = (nqueued + 1) * self.page_bytes + RESERVE_BYTES
+        return available >= needed
@@ -0,0 +1,96 @@
+# combine several PDF files into one PDF/A-1B file
+#
+# the inputs are read one after the other. the pages of each input are
+# written to the output right away and the input is dropped before the next
+# one is read, so memory use does not depend on the number of inputs.
+
+import argparse
+import pathlib
+import gc
+
+import pdfrw
+
+from writer import StreamingPdfWriter
+
+
+class PDFMerger:
+    @staticmethod
+    def get_argument_parser():
+        parser = argparse.ArgumentParser(
+            description="Merge PDF files into one PDF/A-1B file")
+        parser.add_argument("outfile",
+                            metavar="OUTPUT",
+                            nargs=1,
+                            help="PDF file to write")
+        parser.add_argument("filenames",
+                            metavar="FILE",
+                            nargs="+",
+                            help="PDF files to merge")
+        parser.add_argument("--title",
+                            dest="title",
+                            default=None,
+                            help="title (default: from the first file)")
+        parser.add_argument("--author",
+                            dest="author",
+                            default=None,
+                            help="author (default: from the first file)")
+        parser.add_argument("--subject",
+                            dest="subject",
+                            default=None,
+                            help="subject (default: from the first file)")
+        parser.add_argument("--keywords",
+                            dest="keywords",
+                            default=None,
+                            help="keywords (default: from the first file)")
+        parser.add_argument("--no-dedup",
+                            action="store_false",
+                            dest="dedup",
+                            default=True,
+                            help="don't share identical images")
+        parser.add_argument("-l",
+                            "--linearize",
+                            action="store_true",
+                            dest="linearize",
+                            default=False,
+                            help="write a linearized (fast web view) file")
+        return parser
+
+    def __init__(self, options):
+        self.options = options
+        self.outpath = pathlib.Path(options.outfile[0]).absolute()
+        for fn in options.filenames:
+            if pathlib.Path(fn).absolute() == self.outpath:
+                raise RuntimeError("Output file is also an input file")
+
+    def run(self):
+        from metadata import PDFMetadata
+        from colors import SRGBColorspace
+
+        writer = StreamingPdfWriter(self.outpath,
+                                    version="1.4",
+                                    dedup=self.options.dedup)
+        metadata = None
+        for fn in self.options.filenames:
+            print("* {:s}".format(fn))
+            reader = pdfrw.PdfReader(fn)
+            if metadata is None:
+                metadata = PDFMetadata(pdfInfo=reader.Info or {})
+            writer.addpages(reader.pages)
+            # pdfrw objects reference each other in cycles, so the reader is
+            # only freed by the garbage collector
+            del reader
+            gc.collect()
+
+        for thing in ("title", "author", "subject", "keywords"):
+            value = getattr(self.options, thing)
+            if value is not None:
+                setattr(metadata, thing, value)
+
+        writer.trailer.Info = metadata.pdfInfo()
+        writer.trailer.ID = metadata.pdfID()
+        writer.trailer.Root.Metadata = metadata.pdfXMP()
+        writer.trailer.Root.OutputIntents = SRGBColorspace().pdfOutputIntent()
+        writer.write()
+        if self.options.linearize:
+            from writer import linearize
+            linearize(self.outpath)
@@ -3,17 +3,24 @@ import hashlib
 import ctypes
 import base64
 import io
+import typing
 
-from PIL import Image
 from dateutil.tz import tzlocal
 
 import pdfrw
-import libxmp
+
+if typing.TYPE_CHECKING:
+    from PIL import Image
+
+# libxmp (exempi) and pillow are imported where they are used. both are slow
+# to load and not every tool that handles metadata needs them.
 
 
 class XMPGenerator:
     """This class spits out PDF/A-1B compliant XMP Metadata as a pdfrw PDFDict."""
     def __init__(self, pdf_metadata):
+        import libxmp
+
         self.pdf_metadata = pdf_metadata
         self.n_thumbnail = 0
 
@@ -73,6 +80,8 @@ string. See [1] for references."""
             self.add_thumbnail(self.pdf_metadata.thumbnail)
 
     def make_output(self):
+        import libxmp
+
         # generate the output string
         ostr = libxmp.core._remove_trailing_whitespace(
             self.md.serialize_to_str().replace("\ufeff", ""))
@@ -86,6 +95,7 @@ string. See [1] for references."""
     def add_time(self, name, time):
         """Need to dig into the C library here because the Python wrapper does not save
 the correct time zone offset."""
+        import libxmp
 
         # construct the internal XMP date object
         xmp_date = libxmp.exempi.XmpDateTime()
@@ -119,7 +129,7 @@ the correct time zone offset."""
                                   ctypes.byref(xmp_date),
                                   ctypes.c_uint32(options))
 
-    def add_thumbnail(self, thumbnail: Image):
+    def add_thumbnail(self, thumbnail: "Image.Image"):
         """add a thumbnail to the xmp metadata"""
 
         self.n_thumbnail = self.n_thumbnail + 1
@@ -212,9 +222,14 @@ data. this class holds data for which this is true."""
         return XMPGenerator(self).generate_xmp()
 
 
-def get_thumbnail(fp, size):
-    """return a thumbnail for the image saved in 'fp'"""
-    img = Image.open(fp)
+def get_thumbnail(fp, size, frame=None):
+    """return a thumbnail for the image saved in 'fp'. for multi-page files,
+'frame' selects the page."""
+    from images import open_page
+
+    img = open_page(fp, frame)
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
     img.thumbnail(size)
     return img
 
@@ -5,9 +5,6 @@ import pathlib
 
 import pdfrw
 
-from metadata import PDFMetadata
-from colors import SRGBColorspace
-
 
 class PageDropper:
     @staticmethod
@@ -35,6 +32,12 @@ class PageDropper:
                             dest="write_metadata",
                             default=True,
                             help="don't write out metadata")
+        parser.add_argument("-l",
+                            "--linearize",
+                            action="store_true",
+                            dest="linearize",
+                            default=False,
+                            help="write a linearized (fast web view) file")
         return parser
 
     def __init__(self, options):
@@ -53,6 +56,11 @@ class PageDropper:
             writer.addpage(page)
 
         if self.options.write_metadata:
+            # imported here, XMP and ICC handling is slow to load and not
+            # needed with --no-metadata
+            from metadata import PDFMetadata
+            from colors import SRGBColorspace
+
             metadata = PDFMetadata(pdfInfo=reader.Info)
             writer.trailer.Info = metadata.pdfInfo()
             writer.trailer.ID = metadata.pdfID()
@@ -61,6 +69,9 @@ class PageDropper:
             ).pdfOutputIntent()
 
         writer.write()
+        if self.options.linearize:
+            from writer import linearize
+            linearize(filepath)
 
         # optionally remove the input
         if not self.options.keep_original:
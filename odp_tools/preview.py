@@ -0,0 +1,150 @@
+# preview a convert-scans job: run the pipeline on a few pages at reduced
+# resolution, show the results on a contact sheet and estimate the size and
+# the run time of the whole job.
+#
+# the size of a page does not grow with the number of pixels: text pages grow
+# about linearly with the resolution, noisy photos faster. so one of the
+# sample pages is also made at full resolution. its size relative to its
+# preview scales the other previews, and its run time is the time per page of
+# the estimate. that errs high, a single page can not overlap noteshrink and
+# the external tools.
+
+import copy
+import argparse
+import time
+import io
+
+from convert import PDFWorkQueue
+from memory import cpu_count
+
+# size of one page on the contact sheet
+CELL_SIZE = (200, 260)
+# height of the caption under every page
+CAPTION_HEIGHT = 16
+
+
+def get_sample(npages, n):
+    """the numbers of 'n' pages spread over the whole document: the middle
+page of each of 'n' equal parts."""
+    n = min(n, npages)
+    return [(2 * i + 1) * npages // (2 * n) for i in range(n)]
+
+
+class PreviewResults:
+    """collect the page PDFs in place of the builders."""
+    def __init__(self):
+        self.pdfs = {}
+
+    def put(self, result):
+        self.pdfs[result.number] = result.thing
+
+    def join(self):
+        pass
+
+
+class PDFPreview:
+    """run the job on options.preview_pages pages at options.preview_scale
+times the output resolution with the configured workers, write the contact
+sheet to options.preview and print the estimates."""
+    def __init__(self, options):
+        self.options = options
+        self.scale = options.preview_scale
+        self.sample = get_sample(len(options.pages), options.preview_pages)
+        self.preview_options = self.get_preview_options()
+
+    def get_preview_options(self):
+        options = copy.copy(self.options)
+        options.pages = [self.options.pages[i] for i in self.sample]
+        options.profiles = {}
+        for name, profile in self.options.profiles.items():
+            preview = copy.copy(profile)
+            preview.general = argparse.Namespace(**vars(profile.general))
+            dpi = profile.general.output_dpi
+            preview.general.output_dpi = max(round(dpi * self.scale), 1)
+            # the budget shrinks with the pages
+            target = profile.general.target_bytes_per_page
+            if target:
+                preview.general.target_bytes_per_page = target * self.scale**2
+            options.profiles[name] = preview
+        return options
+
+    def run(self):
+        # the workers are forked from this process. with the libraries
+        # imported here, the timings do not include the imports.
+        import noteshrink  # noqa: F401
+        import sklearn.cluster  # noqa: F401
+        import img2pdf  # noqa: F401
+
+        pdfs, elapsed, nworkers = self.run_pages(self.preview_options)
+        # the sample page in the middle at full resolution
+        calibration = len(self.sample) // 2
+        options = copy.copy(self.options)
+        options.pages = [self.options.pages[self.sample[calibration]]]
+        full_pdfs, page_time, _ = self.run_pages(options)
+
+        self.write_contact_sheet(pdfs)
+        npages = len(self.options.pages)
+        print("Preview of {:d} of {:d} pages at {:.0%} resolution: "
+              "{:.1f}s with {:d} workers.".format(len(self.sample), npages,
+                                                  self.scale, elapsed,
+                                                  nworkers))
+        for name, profile in self.options.profiles.items():
+            sizes = [len(pdfs[number][name]) for number in pdfs]
+            ratio = len(full_pdfs[0][name]) / len(pdfs[calibration][name])
+            page_bytes = ratio * sum(sizes) / len(sizes)
+            print("{:s} ({:s}): {:.1f} kB per page, {:.1f} MB in "
+                  "total".format(name, profile.general.pdfname,
+                                 page_bytes / 1e3,
+                                 page_bytes * npages / 1e6))
+        # the workers only run in parallel as far as there are CPUs
+        parallel = min(nworkers, cpu_count())
+        print("Projected time: {:.1f} min with {:d} workers ({:.1f}s per "
+              "page).".format(page_time * npages / parallel / 60, nworkers,
+                              page_time))
+        print("Contact sheet: {:s}".format(self.options.preview))
+
+    def run_pages(self, options):
+        """run the pages and profiles of 'options' through the workers.
+returns the page PDFs, the time it took and the number of workers."""
+        wq = PDFWorkQueue(options)
+        results = PreviewResults()
+        start = time.monotonic()
+        wq.run(results)
+        return results.pdfs, time.monotonic() - start, wq.nworkers
+
+    def write_contact_sheet(self, pdfs):
+        """one cell per sample page and profile, the profiles side by side.
+every cell shows the largest image on the page with the page number and the
+profile name under it."""
+        import img2pdf
+        import pdfrw
+        from PIL import Image
+        from PIL import ImageDraw
+
+        from images import get_page_thumbnail
+
+        names = list(self.options.profiles)
+        ncols = len(names) * max(4 // len(names), 1)
+        cells = [(number, name) for number in sorted(pdfs) for name in names]
+        nrows = (len(cells) + ncols - 1) // ncols
+        width, height = CELL_SIZE
+        sheet = Image.new("RGB",
+                          (ncols * width, nrows * (height + CAPTION_HEIGHT)),
+                          (255, 255, 255))
+        draw = ImageDraw.Draw(sheet)
+        for i, (number, name) in enumerate(cells):
+            x = (i % ncols) * width
+            y = (i // ncols) * (height + CAPTION_HEIGHT)
+            reader = pdfrw.PdfReader(fdata=pdfs[number][name], verbose=False)
+            thumbnail = get_page_thumbnail(reader.pages[0], CELL_SIZE)
+            if thumbnail is not None:
+                sheet.paste(thumbnail, (x + (width - thumbnail.width) // 2,
+                                        y + (height - thumbnail.height) // 2))
+            caption = "p. {:d}".format(self.sample[number] + 1)
+            if len(names) > 1:
+                caption = "{:s} {:s}".format(caption, name)
+            draw.text((x + 4, y + height + 2), caption, fill=(0, 0, 0))
+        imbuf = io.BytesIO()
+        sheet.save(imbuf, format="PNG", optimize=True)
+        with open(self.options.preview, "wb") as f:
+            img2pdf.convert(imbuf.getvalue(), outputstream=f)
@@ -0,0 +1,312 @@
+# run the convert-scans workers on other machines.
+#
+# the coordinator (convert-scans --listen) owns the list of pages and the
+# PDFBuilders. workers (convert-worker) connect over TCP, get the options and
+# then the pages one by one, and send back the page PDFs. the pages are sent
+# as image data, so the workers do not need access to the input files. the
+# coordinator prepares that data in a few threads ahead of time, so that
+# decoding the frames of multi-page inputs does not hold up the results.
+#
+# the connections are multiprocessing.connection connections. they pickle
+# everything, so both sides authenticate with the shared key in
+# ODP_TOOLS_AUTHKEY before anything else is sent.
+
+import multiprocessing
+import multiprocessing.connection
+import concurrent.futures
+import collections
+import itertools
+import threading
+import socket
+import queue
+import time
+import os
+import io
+
+from convert import NumberedThing
+from convert import PDFBuilderThreads
+from convert import PDFWorker
+
+AUTHKEY_VARIABLE = "ODP_TOOLS_AUTHKEY"
+# a worker that has not sent anything for this long while it has pages is
+# considered dead, its pages go to the other workers
+TASK_TIMEOUT = 600
+# a page that was in flight on this many lost workers stops the job
+MAX_ATTEMPTS = 3
+# threads that read the pages for the workers
+READ_THREADS = 2
+
+
+def get_authkey():
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise RuntimeError("Set {:s} to the same secret on the coordinator "
+                           "and the workers".format(AUTHKEY_VARIABLE))
+    return authkey.encode()
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)"""
+    host, _, port = address.rpartition(":")
+    return (host or "localhost", int(port))
+
+
+def get_page_name(filename, frame):
+    if frame is None:
+        return filename
+    return "page {:d} of {:s}".format(frame + 1, filename)
+
+
+def read_page(filename, frame):
+    """the image data of one page. single images and the JPEGs of PDF pages
+are sent as they are, other frames of multi-page files are sent as PNG."""
+    from images import get_page_jpeg
+    from images import open_page
+
+    if frame is None:
+        with open(filename, "rb") as f:
+            return f.read()
+    jpeg = get_page_jpeg(filename, frame)
+    if jpeg is not None:
+        return jpeg
+    img = open_page(filename, frame)
+    obuf = io.BytesIO()
+    img.save(obuf, format="PNG", compress_level=1)
+    return obuf.getvalue()
+
+
+class PDFCoordinator:
+    """hand out the pages to the workers that connect to 'address' and pass
+their results to the builders. every worker has a few pages in flight. if a
+worker goes away or does not answer for 'timeout' seconds, its pages are
+handed out again, at most MAX_ATTEMPTS times."""
+    def __init__(self, options, address, authkey, timeout=None):
+        self.options = options
+        self.timeout = TASK_TIMEOUT if timeout is None else timeout
+        self.todo = collections.deque(
+            NumberedThing(number, page)
+            for number, page in enumerate(options.pages))
+        # pages per worker: the one it works on and those waiting for the
+        # external tools, plus one, so that it never waits for the network
+        self.prefetch = max(options.general.pipeline_depth, 1) + 1
+        self.listener = multiprocessing.connection.Listener(
+            parse_address(address), authkey=authkey)
+        self.new_conns = queue.Queue()
+        # connection -> pages in flight, time of the last message
+        self.in_flight = {}
+        self.last_seen = {}
+        # page number -> number of lost workers it was in flight on
+        self.attempts = collections.Counter()
+        # page number -> future of the page data. the threads wake up the
+        # main loop when a page is ready, so do new connections.
+        self.reader = concurrent.futures.ThreadPoolExecutor(
+            max_workers=READ_THREADS)
+        self.data = {}
+        self.wakeup, self.waker = socket.socketpair()
+        self.waker.setblocking(False)
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except OSError:
+                # the listener was closed
+                return
+            conn.send(self.options)
+            self.new_conns.put(conn)
+            self.wake()
+
+    def wake(self, *args):
+        """let the main loop look at the new connections and pages."""
+        try:
+            self.waker.send(b"\0")
+        except OSError:
+            # the main loop has enough wake-ups pending, or it is done
+            pass
+
+    def run(self):
+        accept_thread = threading.Thread(target=self.accept, daemon=True)
+        accept_thread.start()
+
+        remaining = len(self.options.pages)
+        builders = PDFBuilderThreads(self.options, remaining)
+        done = set()
+        try:
+            while len(done) < remaining:
+                while not self.new_conns.empty():
+                    conn = self.new_conns.get()
+                    self.in_flight[conn] = []
+                    self.last_seen[conn] = time.monotonic()
+                    self.fill(conn)
+                for conn in multiprocessing.connection.wait(
+                        list(self.in_flight) + [self.wakeup], timeout=1.0):
+                    if conn is self.wakeup:
+                        self.wakeup.recv(4096)
+                        continue
+                    try:
+                        result = conn.recv()
+                    except (EOFError, OSError):
+                        self.drop(conn)
+                        continue
+                    self.last_seen[conn] = time.monotonic()
+                    self.in_flight[conn] = [
+                        item for item in self.in_flight[conn]
+                        if item.number != result.number
+                    ]
+                    # a page that was handed out again may come back twice
+                    if result.number not in done:
+                        done.add(result.number)
+                        builders.put(result)
+                    self.fill(conn)
+                now = time.monotonic()
+                for conn in list(self.in_flight):
+                    if (self.in_flight[conn]
+                            and now - self.last_seen[conn] > self.timeout):
+                        self.drop(conn)
+                # pages of dropped workers go to the others
+                for conn in list(self.in_flight):
+                    self.fill(conn)
+            builders.join()
+        finally:
+            # the workers stop when they get None
+            for conn in list(self.in_flight):
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+            self.listener.close()
+            self.reader.shutdown(wait=False, cancel_futures=True)
+            self.wakeup.close()
+            self.waker.close()
+
+    def read_ahead(self):
+        """start reading the next pages, enough to fill every worker."""
+        nahead = self.prefetch * max(len(self.in_flight), 1)
+        for item in itertools.islice(self.todo, nahead):
+            if item.number not in self.data:
+                future = self.reader.submit(read_page, *item.thing)
+                future.add_done_callback(self.wake)
+                self.data[item.number] = future
+
+    def fill(self, conn):
+        """send pages to 'conn' until it has enough in flight. the pages go
+out in order, as soon as their data is ready."""
+        self.read_ahead()
+        while self.todo and len(self.in_flight[conn]) < self.prefetch:
+            item = self.todo[0]
+            future = self.data[item.number]
+            if not future.done():
+                return
+            try:
+                conn.send(NumberedThing(item.number, future.result()))
+            except OSError:
+                self.drop(conn)
+                return
+            self.todo.popleft()
+            del self.data[item.number]
+            self.in_flight[conn].append(item)
+            self.read_ahead()
+
+    def drop(self, conn):
+        """forget the worker on 'conn' and hand out its pages again. the page
+that crashed the worker is among them, so a page that was in flight on too
+many lost workers ends the job."""
+        items = self.in_flight.pop(conn)
+        del self.last_seen[conn]
+        conn.close()
+        for item in items:
+            self.attempts[item.number] += 1
+        failed = [
+            get_page_name(*item.thing) for item in items
+            if self.attempts[item.number] >= MAX_ATTEMPTS
+        ]
+        if failed:
+            raise RuntimeError("Lost {:d} workers while they had {:s}".format(
+                MAX_ATTEMPTS, ", ".join(failed)))
+        self.todo.extendleft(reversed(items))
+
+
+class RemoteWorkQueue:
+    """the work queue of a PDFWorker on a worker machine. the pages arrive as
+image data, which the worker opens like a file."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self):
+        item = self.conn.recv()
+        if item is None:
+            return None
+        return NumberedThing(item.number, (io.BytesIO(item.thing), None))
+
+    def get_nowait(self):
+        if not self.conn.poll():
+            raise queue.Empty
+        return self.get()
+
+
+class RemoteResultsQueue:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def put(self, result):
+        self.conn.send(result)
+
+
+class RemoteWorker:
+    """connect to a coordinator and run a PDFWorker on the pages it sends.
+with --jobs, several workers run in parallel, each with its own connection."""
+    @staticmethod
+    def get_argument_parser():
+        import argparse
+
+        parser = argparse.ArgumentParser(
+            description="Process pages for convert-scans --listen.")
+        parser.add_argument("address",
+                            metavar="HOST:PORT",
+                            help="address of the coordinator")
+        parser.add_argument("-j",
+                            "--jobs",
+                            type=int,
+                            default=1,
+                            help="number of worker processes")
+        parser.add_argument("--wait",
+                            type=float,
+                            default=30,
+                            help="seconds to wait for the coordinator")
+        return parser
+
+    def __init__(self, args):
+        self.address = parse_address(args.address)
+        self.authkey = get_authkey()
+        self.wait = args.wait
+        procs = []
+        for _ in range(args.jobs):
+            proc = multiprocessing.Process(target=self.work)
+            procs.append(proc)
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+    def connect(self):
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                return multiprocessing.connection.Client(self.address,
+                                                         authkey=self.authkey)
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def work(self):
+        with self.connect() as conn:
+            options = conn.recv()
+            try:
+                PDFWorker(RemoteWorkQueue(conn), RemoteResultsQueue(conn),
+                          options)
+            except (EOFError, OSError):
+                # the coordinator finished or went away
+                pass
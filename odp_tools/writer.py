@@ -0,0 +1,198 @@
+# write PDF files without keeping the whole document in memory
+#
+# pdfrw's PdfWriter collects every page and formats the file in one go when
+# write() is called. that is fine for single documents, but when many files
+# are combined, all of them stay in memory until the end. the writer below
+# formats and writes the objects of each batch of pages right away and then
+# forgets them. only the object offsets and the page references are kept.
+#
+# linearize() turns any finished file into a linearized ("fast web view") file,
+# so that viewers can show the first page before the whole file is loaded.
+
+import pathlib
+
+import pdfrw
+from pdfrw.pdfwriter import user_fmt
+
+from images import ImageIndex
+
+
+class StreamingPdfWriter:
+    """write a PDF file page by page. add pages with addpages(), fill in the
+trailer (Info, ID, Root.Metadata, ...) like for a pdfrw.PdfWriter and call
+write() to finish the file. identical images are only written once."""
+    def __init__(self, fname, version="1.4", dedup=True):
+        self.f = open(fname, "wb")
+        self.offset = 0
+        self.offsets = []
+        self.kids = []
+        self.trailer = pdfrw.PdfDict(Root=pdfrw.IndirectPdfDict())
+        # image hashes and the references of the written objects
+        self.images = ImageIndex() if dedup else None
+        self.image_refs = {}
+
+        self.write_raw("%PDF-{:s}\n%\xe2\xe3\xcf\xd3\n".format(version))
+        self.pages_ref = self.reserve()
+
+    def write_raw(self, s):
+        data = s.encode("latin-1")
+        self.f.write(data)
+        self.offset = self.offset + len(data)
+
+    def reserve(self):
+        """reserve an object number and return a reference to it."""
+        self.offsets.append(None)
+        return pdfrw.PdfObject("{:d} 0 R".format(len(self.offsets)))
+
+    def addpages(self, pages):
+        """write 'pages' and everything they reference. the pages should come
+from the same document, references between them are kept."""
+        pages = list(pages)
+        # pages can reference each other (links, annotations), so they are
+        # numbered up front. the old page tree is replaced by the new one.
+        refs = {}
+        numbers = []
+        for page in pages:
+            ref = self.reserve()
+            refs[id(page)] = ref
+            numbers.append(ref)
+        for page in pages:
+            parent = page.Parent
+            while parent is not None and id(parent) not in refs:
+                refs[id(parent)] = self.pages_ref
+                parent = parent.Parent
+
+        for page, ref in zip(pages, numbers):
+            inheritable = page.inheritable
+            newpage = pdfrw.PdfDict(page)
+            newpage.Parent = self.pages_ref
+            newpage.Resources = inheritable.Resources
+            newpage.MediaBox = inheritable.MediaBox
+            newpage.CropBox = inheritable.CropBox
+            newpage.Rotate = inheritable.Rotate
+            self.write_object(ref, newpage, refs)
+        self.kids.extend(numbers)
+
+    def write_object(self, ref, obj, refs):
+        """write 'obj' as indirect object 'ref', followed by all indirect
+objects it references that have not been written yet."""
+        deferred = [(ref, obj)]
+        while deferred:
+            ref, obj = deferred.pop()
+            body = self.format_obj(obj, refs, deferred)
+            objnum = int(ref.split()[0])
+            self.offsets[objnum - 1] = self.offset
+            self.write_raw("{:d} 0 obj\n{:s}\nendobj\n".format(objnum, body))
+
+    def add(self, obj, refs, deferred):
+        """format a direct object, or return a reference to an indirect one
+and queue it for writing."""
+        if isinstance(obj, pdfrw.PdfDict):
+            indirect = obj.indirect or (obj.stream is not None)
+        else:
+            indirect = getattr(obj, "indirect", False)
+        if not indirect:
+            return self.format_obj(obj, refs, deferred)
+
+        ref = refs.get(id(obj))
+        if ref is not None:
+            return ref
+        digest = None
+        if (self.images is not None and isinstance(obj, pdfrw.PdfDict)
+                and obj.Subtype == pdfrw.PdfName.Image):
+            digest = self.images.digest(obj)
+            ref = self.image_refs.get(digest)
+            if ref is not None:
+                self.images.nshared = self.images.nshared + 1
+                refs[id(obj)] = ref
+                return ref
+        ref = self.reserve()
+        refs[id(obj)] = ref
+        if digest is not None:
+            self.image_refs[digest] = ref
+        deferred.append((ref, obj))
+        return ref
+
+    def format_obj(self, obj, refs, deferred):
+        if isinstance(obj, pdfrw.PdfArray) or isinstance(obj, (list, tuple)):
+            return self.format_array(
+                [self.add(x, refs, deferred) for x in obj], "[{:s}]")
+        if isinstance(obj, dict):
+            if not isinstance(obj, pdfrw.PdfDict):
+                obj = pdfrw.PdfDict(obj)
+            items = []
+            for key, value in sorted(obj.iteritems()):
+                items.append(key)
+                items.append(self.add(value, refs, deferred))
+            result = self.format_array(items, "<<{:s}>>")
+            if obj.stream is not None:
+                result = "{:s}\nstream\n{:s}\nendstream".format(
+                    result, obj.stream)
+            return result
+        if hasattr(obj, "indirect"):
+            return str(getattr(obj, "encoded", None) or obj)
+        return user_fmt(obj)
+
+    def format_array(self, items, fmt):
+        # same layout as pdfrw, at most ~70 characters per line
+        lines = []
+        count = 71
+        for x in items:
+            if count + len(x) + 1 > 71:
+                lines.append([])
+                count = 0
+            lines[-1].append(x)
+            count = count + len(x) + 1
+        return fmt.format("\n  ".join(" ".join(line) for line in lines))
+
+    def write(self):
+        """write the page tree, catalog, trailer and cross-reference table
+and close the file."""
+        refs = {}
+        pages = pdfrw.PdfDict(Type=pdfrw.PdfName.Pages,
+                              Count=pdfrw.PdfObject(len(self.kids)),
+                              Kids=pdfrw.PdfArray(self.kids))
+        self.write_object(self.pages_ref, pages, refs)
+
+        root = self.trailer.Root
+        root.Type = pdfrw.PdfName.Catalog
+        root.Pages = self.pages_ref
+        # format the trailer first, this writes all objects it references
+        deferred = []
+        self.trailer.Size = None
+        self.format_obj(self.trailer, refs, deferred)
+        while deferred:
+            self.write_object(*deferred.pop(), refs)
+        self.trailer.Size = pdfrw.PdfObject(len(self.offsets) + 1)
+        trailer = self.format_obj(self.trailer, refs, deferred)
+
+        xref_offset = self.offset
+        self.write_raw("xref\n0 {:d}\n".format(len(self.offsets) + 1))
+        self.write_raw("{:010d} {:05d} f\r\n".format(0, 65535))
+        for offset in self.offsets:
+            self.write_raw("{:010d} {:05d} n\r\n".format(offset, 0))
+        self.write_raw("trailer\n\n{:s}\nstartxref\n{:d}\n%%EOF\n".format(
+            trailer, xref_offset))
+        self.f.close()
+
+
+def linearize(fname):
+    """rewrite the finished PDF file 'fname' in place as a linearized file: the
+first page, its objects and the hint tables come first. qpdf (through pikepdf)
+does the actual work. the options keep the file PDF/A-1B: no object streams,
+no new compression of the metadata and no changes to the XMP packet."""
+    try:
+        import pikepdf
+    except ImportError:
+        raise RuntimeError("Linearized output needs pikepdf")
+
+    path = pathlib.Path(fname)
+    tmppath = path.with_name(path.name + ".lin")
+    with pikepdf.open(path) as pdf:
+        pdf.save(tmppath,
+                 linearize=True,
+                 preserve_pdfa=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.disable,
+                 compress_streams=False,
+                 fix_metadata_version=False)
+    tmppath.replace(path)
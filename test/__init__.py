@@ -1 +1,62 @@
+# helpers for the tests that run convert-scans jobs: an options file and
+# synthetic scans. the test scripts import this as the package "test", with
+# the repository in front of sys.path.
 
+from pathlib import Path
+
+from PIL import Image
+
+OPTIONS = """general:
+  pdfname: "{pdfname:s}"
+  dpi: 100
+  nworkers: {nworkers:d}
+metadata:
+  title: "t"
+  author: "a"
+  subject: "s"
+  keywords: "k"
+  creator: "c"
+noteshrink:
+  enable: True
+  num_colors: {num_colors:d}
+  sample_fraction: 0.1
+pngquant:
+  enable: False
+optipng:
+  enable: False
+"""
+
+
+def write_options(tempdir, nworkers=2, num_colors=4, profiles=None):
+    """write the options of a job that writes out.pdf in 'tempdir'. a
+'profiles' string is added as the profiles section. returns the name of the
+options file and of the pdf."""
+    pdfname = str(Path(tempdir) / "out.pdf")
+    yaml = str(Path(tempdir) / "options.yaml")
+    with open(yaml, "w") as f:
+        f.write(
+            OPTIONS.format(pdfname=pdfname,
+                           nworkers=nworkers,
+                           num_colors=num_colors))
+        if profiles is not None:
+            f.write("profiles:\n" + profiles)
+    return yaml, pdfname
+
+
+def make_pages(tempdir, npages, size=(400, 500), widen=0, colors=()):
+    """write 'npages' scans with a dark bar that moves down from page to page.
+every page is 'widen' pixels wider than the one before, so that the order of
+the pages can be checked. 'colors' adds swatches of more ink colors. returns
+the filenames."""
+    filenames = []
+    for i in range(npages):
+        filename = str(Path(tempdir) / "page-{:d}.png".format(i))
+        width, height = size[0] + widen * i, size[1]
+        img = Image.new("RGB", (width, height), (250, 250, 240))
+        img.paste((20, 20, 120), (50, 50 + 50 * i, width - 50, 80 + 50 * i))
+        for j, color in enumerate(colors):
+            img.paste(color,
+                      (50 + 50 * j, height - 200, 90 + 50 * j, height - 100))
+        img.save(filename)
+        filenames.append(filename)
+    return filenames
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import sys
+import io
+import zlib
+import tempfile
+import unittest
+from pathlib import Path
+
+import pdfrw
+import img2pdf
+from PIL import Image
+
+DIR = Path(__file__).absolute().parent
+sys.path.append(str(DIR.parent / "odp_tools"))
+
+from images import ImageIndex
+from images import get_page_thumbnail
+from images import get_page_size
+from images import get_largest_image
+from images import get_pages
+from images import decode_image
+from images import read_pdf
+from images import open_page
+
+
+def page_from_img(img: Image.Image):
+    imbuf = io.BytesIO()
+    img.save(imbuf, format="PNG")
+    buf = io.BytesIO()
+    img2pdf.convert(imbuf.getvalue(), outputstream=buf)
+    return pdfrw.PdfReader(fdata=buf.getvalue(), verbose=False).pages[0]
+
+
+def page_from_xobj(xobj):
+    return pdfrw.PdfDict(Type=pdfrw.PdfName.Page,
+                         Resources=pdfrw.PdfDict(XObject=pdfrw.PdfDict(
+                             Im0=xobj)))
+
+
+def count_images(pdfbytes):
+    reader = pdfrw.PdfReader(fdata=pdfbytes, verbose=False)
+    refs = set()
+    for page in reader.pages:
+        for xobj in page.Resources.XObject.values():
+            refs.add(id(xobj))
+    return len(refs)
+
+
+class TestImageIndex(unittest.TestCase):
+    def test_dedup(self):
+        blank = Image.new("RGB", (200, 300), (255, 255, 255))
+        text = Image.new("RGB", (200, 300), (0, 0, 0))
+        pages = [page_from_img(img) for img in (text, blank, text, blank)]
+        index = ImageIndex()
+        writer = pdfrw.PdfWriter(version="1.4")
+        for page in pages:
+            index.dedup_page(page)
+            writer.addpage(page)
+        self.assertEqual(index.nshared, 2)
+        buf = io.BytesIO()
+        writer.write(buf)
+        self.assertEqual(count_images(buf.getvalue()), 2)
+
+    def test_different_size(self):
+        # same pixels, different dimensions must not be shared
+        index = ImageIndex()
+        for size in ((200, 300), (300, 200)):
+            page = page_from_img(Image.new("RGB", size, (255, 255, 255)))
+            index.dedup_page(page)
+        self.assertEqual(index.nshared, 0)
+
+
+class TestThumbnail(unittest.TestCase):
+    def test_thumbnail(self):
+        # drop.pdf has Flate images with PNG predictors, non_compliant.pdf
+        # has JPEGs
+        for name in ("drop.pdf", "non_compliant.pdf"):
+            reader = pdfrw.PdfReader(str(DIR / "samples" / name))
+            thumbnail = get_page_thumbnail(reader.pages[0], (300, 300))
+            self.assertEqual(thumbnail.mode, "RGB")
+            self.assertEqual(max(thumbnail.size), 300)
+
+    def test_raw_flate(self):
+        img = Image.new("RGB", (640, 480), (10, 20, 30))
+        xobj = pdfrw.PdfDict(Type=pdfrw.PdfName.XObject,
+                             Subtype=pdfrw.PdfName.Image,
+                             Width=640,
+                             Height=480,
+                             ColorSpace=pdfrw.PdfName.DeviceRGB,
+                             BitsPerComponent=8,
+                             Filter=pdfrw.PdfName.FlateDecode)
+        xobj.stream = zlib.compress(img.tobytes()).decode("latin-1")
+        thumbnail = get_page_thumbnail(page_from_xobj(xobj), (64, 64))
+        self.assertEqual(thumbnail.size, (64, 48))
+        self.assertEqual(thumbnail.getpixel((10, 10)), (10, 20, 30))
+
+    def test_colorspaces(self):
+        # calibrated RGB is decoded like DeviceRGB, spot colors are not
+        # supported and give no thumbnail instead of an error
+        img = Image.new("RGB", (64, 48), (10, 20, 30))
+        for colorspace, expected in (
+            ([pdfrw.PdfName.CalRGB,
+              pdfrw.PdfDict(WhitePoint=[1, 1, 1])], (10, 20, 30)),
+            ([
+                pdfrw.PdfName.Separation,
+                pdfrw.PdfName.Spot, pdfrw.PdfName.DeviceCMYK,
+                pdfrw.PdfDict()
+            ], None),
+        ):
+            xobj = pdfrw.PdfDict(Type=pdfrw.PdfName.XObject,
+                                 Subtype=pdfrw.PdfName.Image,
+                                 Width=64,
+                                 Height=48,
+                                 ColorSpace=pdfrw.PdfArray(colorspace),
+                                 BitsPerComponent=8,
+                                 Filter=pdfrw.PdfName.FlateDecode)
+            xobj.stream = zlib.compress(img.tobytes()).decode("latin-1")
+            thumbnail = get_page_thumbnail(page_from_xobj(xobj), (64, 64))
+            if expected is None:
+                self.assertIsNone(thumbnail)
+            else:
+                self.assertEqual(thumbnail.getpixel((10, 10)), expected)
+
+    def test_decodeparms_array(self):
+        # with /Filter [/FlateDecode], the parameters are an array too. PNG
+        # predictor data: every row starts with its filter type, 0 is none.
+        img = Image.new("RGB", (64, 48), (10, 20, 30))
+        rows = img.tobytes()
+        data = b"".join(b"\0" + rows[i:i + 64 * 3]
+                        for i in range(0, len(rows), 64 * 3))
+        filters = pdfrw.PdfArray([pdfrw.PdfName.FlateDecode])
+        parms = pdfrw.PdfDict(Predictor=15, Colors=3, Columns=64)
+        xobj = pdfrw.PdfDict(Type=pdfrw.PdfName.XObject,
+                             Subtype=pdfrw.PdfName.Image,
+                             Width=64,
+                             Height=48,
+                             ColorSpace=pdfrw.PdfName.DeviceRGB,
+                             BitsPerComponent=8,
+                             Filter=filters,
+                             DecodeParms=pdfrw.PdfArray([parms]))
+        xobj.stream = zlib.compress(data).decode("latin-1")
+        thumbnail = get_page_thumbnail(page_from_xobj(xobj), (64, 64))
+        self.assertEqual(thumbnail.getpixel((10, 10)), (10, 20, 30))
+
+
+class TestInputPages(unittest.TestCase):
+    def test_multipage(self):
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+        imgs = [Image.new("RGB", (200, 300), c) for c in colors]
+        with tempfile.TemporaryDirectory() as tempdir:
+            tiff = str(Path(tempdir) / "scan.tif")
+            imgs[0].save(tiff, save_all=True, append_images=imgs[1:])
+            pdf = str(Path(tempdir) / "scan.pdf")
+            imbufs = []
+            for img in imgs:
+                imbuf = io.BytesIO()
+                img.save(imbuf, format="PNG")
+                imbufs.append(imbuf.getvalue())
+            with open(pdf, "wb") as f:
+                img2pdf.convert(imbufs, outputstream=f)
+            png = str(Path(tempdir) / "scan.png")
+            imgs[0].save(png)
+
+            self.assertEqual(get_pages(png), [(png, None)])
+            for filename in (tiff, pdf):
+                pages = get_pages(filename)
+                self.assertEqual(pages, [(filename, i) for i in range(3)])
+                for (_, frame), color in zip(pages, colors):
+                    img = open_page(filename, frame).convert("RGB")
+                    self.assertEqual(img.size, (200, 300))
+                    self.assertEqual(img.getpixel((10, 10)), color)
+
+    def test_unusable_page(self):
+        img = Image.new("RGB", (64, 48), (10, 20, 30))
+        writer = pdfrw.PdfWriter()
+        # a colorspace that is not supported and broken image data
+        for colorspace, data in (
+            (pdfrw.PdfArray([pdfrw.PdfName.Lab, pdfrw.PdfDict()]),
+             zlib.compress(img.tobytes())),
+            (pdfrw.PdfName.DeviceRGB, b"garbage"),
+        ):
+            xobj = pdfrw.IndirectPdfDict(Type=pdfrw.PdfName.XObject,
+                                         Subtype=pdfrw.PdfName.Image,
+                                         Width=64,
+                                         Height=48,
+                                         ColorSpace=colorspace,
+                                         BitsPerComponent=8,
+                                         Filter=pdfrw.PdfName.FlateDecode)
+            xobj.stream = data.decode("latin-1")
+            page = page_from_xobj(xobj)
+            page.MediaBox = [0, 0, 64, 48]
+            writer.addpage(page)
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf = str(Path(tempdir) / "scan.pdf")
+            writer.write(pdf)
+            for frame in range(2):
+                self.assertEqual(get_page_size(pdf, frame), (64, 48))
+                with self.assertRaisesRegex(RuntimeError,
+                                            "no usable image"):
+                    open_page(pdf, frame)
+
+    def test_lazy_pdf(self):
+        # an indexed image with a string palette, on a page that inherits
+        # its resources, and an RGB image
+        xobj = pdfrw.IndirectPdfDict(Type=pdfrw.PdfName.XObject,
+                                     Subtype=pdfrw.PdfName.Image,
+                                     Width=4,
+                                     Height=2,
+                                     BitsPerComponent=8,
+                                     Filter=pdfrw.PdfName.FlateDecode)
+        xobj.ColorSpace = pdfrw.PdfArray([
+            pdfrw.PdfName.Indexed, pdfrw.PdfName.DeviceRGB, 2,
+            pdfrw.PdfString.from_bytes(bytes([255, 0, 0, 0, 255, 0, 0, 0,
+                                              255]))
+        ])
+        xobj.stream = zlib.compress(bytes([0, 1, 2, 1] * 2)).decode("latin-1")
+        jpeg = io.BytesIO()
+        Image.new("RGB", (80, 60), (10, 200, 30)).save(jpeg, format="JPEG")
+        writer = pdfrw.PdfWriter()
+        writer.addpage(page_from_xobj(xobj))
+        writer.addpage(page_from_img(Image.open(jpeg)))
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf = str(Path(tempdir) / "scan.pdf")
+            writer.write(pdf)
+            reader = pdfrw.PdfReader(pdf)
+            reader.pages[0].Parent.Resources = reader.pages[0].Resources
+            reader.pages[0].Resources = None
+            pdfrw.PdfWriter(pdf, trailer=reader).write()
+
+            read_pdf.cache_clear()
+            reader = pdfrw.PdfReader(pdf)
+            for frame, size in ((0, (4, 2)), (1, (80, 60))):
+                expected = decode_image(get_largest_image(
+                    reader.pages[frame])).convert("RGB")
+                self.assertEqual(get_page_size(pdf, frame), size)
+                img = open_page(pdf, frame).convert("RGB")
+                self.assertEqual(img.tobytes(), expected.tobytes())
+            read_pdf.cache_clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
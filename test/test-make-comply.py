@@ -20,6 +20,12 @@ class TestMakeComply(unittest.TestCase):
         self.assertNotEqual(vera, None)
 
     def test_make_comply(self):
+        self.run_make_comply(thumbnail=False)
+
+    def test_make_comply_thumbnail(self):
+        self.run_make_comply(thumbnail=True)
+
+    def run_make_comply(self, thumbnail):
         print("")
         sample_path = DIR / "samples" / "non_compliant.pdf"
         with tempfile.TemporaryDirectory() as tempdir:
@@ -29,8 +35,9 @@ class TestMakeComply(unittest.TestCase):
             options = Namespace()
             options.filenames = [str(pdf_path)]
             options.keep_original = True
-            options.thumbnail = False
+            options.thumbnail = thumbnail
             options.keep_date = False
+            options.linearize = False
             make_comply = MakePDFCompliant(options)
             make_comply.run()
             self.assertTrue(old_path.exists())
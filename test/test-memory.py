@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import sys
+import queue
+import tempfile
+import collections
+import argparse
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+DIR = Path(__file__).absolute().parent
+sys.path.append(str(DIR.parent / "odp_tools"))
+
+import images
+import memory
+from memory import MemoryBudget
+from convert import PDFWorkQueue
+
+
+def make_options(filenames, output_dpi):
+    options = argparse.Namespace()
+    options.pages = [(filename, None) for filename in filenames]
+    options.general = argparse.Namespace(input_dpi=300,
+                                         output_dpi=output_dpi,
+                                         pipeline_depth=2)
+    options.profiles = {"default": options}
+    return options
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for i, size in enumerate([(850, 1100), (2550, 3300)]):
+            filename = str(Path(self.tempdir.name) / "page-{:d}.png".format(i))
+            Image.new("RGB", size, (255, 255, 255)).save(filename)
+            self.filenames.append(filename)
+        self.available_memory = memory.available_memory
+
+    def tearDown(self):
+        memory.available_memory = self.available_memory
+        self.tempdir.cleanup()
+
+    def test_page_bytes(self):
+        full = MemoryBudget(make_options(self.filenames, 300))
+        half = MemoryBudget(make_options(self.filenames, 150))
+        # the largest page decides
+        self.assertGreater(full.page_bytes, 2550 * 3300 * 30)
+        self.assertLess(half.page_bytes, full.page_bytes / 2)
+
+    def test_container_bytes(self):
+        pdf = str(Path(self.tempdir.name) / "scan.pdf")
+        Image.open(self.filenames[0]).save(pdf)
+        pages = [(self.filenames[0], None), (pdf, 0)]
+        reads_whole_pdf = images.reads_whole_pdf
+        try:
+            images.reads_whole_pdf = lambda: True
+            self.assertEqual(memory.get_container_bytes(pages),
+                             Path(pdf).stat().st_size *
+                             memory.PDF_BYTES_PER_BYTE)
+            # single pages are not read as a whole
+            self.assertEqual(memory.get_container_bytes(pages[:1]), 0)
+            images.reads_whole_pdf = lambda: False
+            self.assertEqual(memory.get_container_bytes(pages), 0)
+        finally:
+            images.reads_whole_pdf = reads_whole_pdf
+
+    def test_nworkers(self):
+        budget = MemoryBudget(make_options(self.filenames, 300))
+        nworkers = budget.get_nworkers()
+        self.assertGreaterEqual(nworkers, 1)
+        self.assertLessEqual(nworkers, memory.cpu_count())
+
+        # room for two workers, but not for a page on top of three queued pages
+        memory.available_memory = lambda: (
+            memory.RESERVE_BYTES + 2 *
+            (memory.WORKER_BYTES + budget.page_bytes))
+        self.assertEqual(budget.get_nworkers(),
+                         min(2, memory.cpu_count()))
+        self.assertTrue(budget.can_dispatch(0))
+        self.assertFalse(budget.can_dispatch(3))
+
+        # never less than one worker
+        memory.available_memory = lambda: 0
+        self.assertEqual(budget.get_nworkers(), 1)
+        self.assertFalse(budget.can_dispatch(0))
+
+
+class FakeBudget:
+    def can_dispatch(self, nqueued):
+        return True
+
+
+class TestDispatch(unittest.TestCase):
+    def test_pipeline(self):
+        # two workers, each shrinks a page while two more wait for the
+        # tools, plus one queued page per worker
+        wq = PDFWorkQueue.__new__(PDFWorkQueue)
+        wq.options = make_options([], 300)
+        wq.todo = collections.deque(range(100))
+        wq.work_queue = queue.Queue()
+        wq.stopping = False
+        wq.budget = FakeBudget()
+        wq.nworkers = 2
+        self.assertEqual(wq.dispatch(0), 8)
+        self.assertEqual(wq.dispatch(7), 8)
+        self.assertEqual(wq.work_queue.qsize(), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import sys
+import tempfile
+import tracemalloc
+import subprocess
+import unittest
+import shutil
+from pathlib import Path
+from argparse import Namespace
+
+import pdfrw
+
+DIR = Path(__file__).absolute().parent
+sys.path.append(str(DIR.parent / "odp_tools"))
+
+from merge import PDFMerger
+
+
+class TestMerge(unittest.TestCase):
+    def test_find_verapdf(self):
+        vera = shutil.which("verapdf")
+        self.assertNotEqual(vera, None)
+
+    def test_merge(self):
+        print("")
+        inputs = [
+            DIR / "samples" / "drop.pdf",
+            DIR / "samples" / "non_compliant.pdf",
+            DIR / "samples" / "drop.pdf",
+        ]
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_path = Path(tempdir) / "merged.pdf"
+            options = Namespace()
+            options.outfile = [str(pdf_path)]
+            options.filenames = [str(x) for x in inputs]
+            options.title = "Merged"
+            options.author = None
+            options.subject = None
+            options.keywords = None
+            options.dedup = True
+            options.linearize = True
+            merger = PDFMerger(options)
+            merger.run()
+            reader = pdfrw.PdfReader(str(pdf_path))
+            self.assertEqual(len(reader.pages), 7)
+            self.assertEqual(reader.Info.Title, "(Merged)")
+            with open(pdf_path, "rb") as ifl:
+                self.assertIn(b"/Linearized", ifl.read(1024))
+            # the second copy of drop.pdf shares the images of the first
+            self.assertLess(pdf_path.stat().st_size,
+                            sum(x.stat().st_size for x in inputs[:2]))
+            cmd = ["verapdf", "-f", "1b", "--format", "text", str(pdf_path)]
+            cp = subprocess.run(cmd, check=True)
+            self.assertEqual(cp.returncode, 0)
+
+    def get_peak(self, ncopies):
+        """peak of the traced memory while 'ncopies' copies of drop.pdf are
+merged."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            options = Namespace()
+            options.outfile = [str(Path(tempdir) / "merged.pdf")]
+            options.filenames = [str(DIR / "samples" / "drop.pdf")] * ncopies
+            options.title = None
+            options.author = None
+            options.subject = None
+            options.keywords = None
+            # without dedup, every copy is written
+            options.dedup = False
+            options.linearize = False
+            merger = PDFMerger(options)
+            tracemalloc.start()
+            try:
+                merger.run()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    def test_flat_memory(self):
+        print("")
+        # the inputs are freed one after the other, so five times as many
+        # inputs need about as much memory
+        few = self.get_peak(3)
+        many = self.get_peak(15)
+        self.assertLess(many, few * 1.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
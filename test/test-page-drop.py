@@ -33,6 +33,7 @@ class TestPageDropper(unittest.TestCase):
             options.keep_original = True
             options.write_metadata = True
             options.pages = [2]
+            options.linearize = False
             pagedropper = PageDropper(options)
             pagedropper.run()
             self.check_page_count(pdf_path, 2)
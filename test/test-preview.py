@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import tempfile
+import subprocess
+import unittest
+import contextlib
+from pathlib import Path
+
+import pdfrw
+
+DIR = Path(__file__).absolute().parent
+TOOLS = DIR.parent / "odp_tools"
+sys.path.append(str(TOOLS))
+sys.path.insert(0, str(DIR.parent))
+
+from convert import Options
+from preview import get_sample
+from test import make_pages
+from test import write_options
+
+
+class TestPreview(unittest.TestCase):
+    def test_sample(self):
+        self.assertEqual(get_sample(100, 4), [12, 37, 62, 87])
+        self.assertEqual(get_sample(3, 8), [0, 1, 2])
+
+    def test_arguments(self):
+        parser = Options.get_argument_parser()
+        ns = parser.parse_args([
+            "--preview-pages", "1", "--preview-scale", "1", "o.yaml",
+            "a.png"
+        ])
+        self.assertEqual((ns.preview_pages, ns.preview_scale), (1, 1.0))
+        for args in (["--preview-pages", "0"], ["--preview-scale", "0"],
+                     ["--preview-scale", "1.5"], ["--preview-scale", "x"]):
+            with self.assertRaises(SystemExit), \
+                    contextlib.redirect_stderr(io.StringIO()):
+                parser.parse_args(args + ["o.yaml", "a.png"])
+
+    def test_preview(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            images = make_pages(tempdir, 6, size=(850, 1100))
+            yaml, pdfname = write_options(tempdir)
+            sheet = str(Path(tempdir) / "sheet.pdf")
+            cp = subprocess.run([
+                sys.executable,
+                str(TOOLS / "convert-scans"), "--preview", sheet,
+                "--preview-pages", "3", yaml
+            ] + images,
+                                check=True,
+                                capture_output=True,
+                                text=True)
+            self.assertIn("Preview of 3 of 6 pages", cp.stdout)
+            self.assertIn("Projected time", cp.stdout)
+            # only the contact sheet is written
+            self.assertEqual(len(pdfrw.PdfReader(sheet).pages), 1)
+            self.assertFalse(Path(pdfname).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import sys
+import queue
+import tempfile
+import unittest
+from pathlib import Path
+
+import pdfrw
+
+DIR = Path(__file__).absolute().parent
+sys.path.append(str(DIR.parent / "odp_tools"))
+sys.path.insert(0, str(DIR.parent))
+
+from convert import NumberedThing
+from convert import Options
+from convert import PDFBuilderThreads
+from convert import PDFWorker
+from images import decode_image
+from test import make_pages
+from test import write_options
+
+COLORS = [(200, 30, 30), (30, 160, 30), (230, 150, 0), (120, 0, 160),
+          (0, 150, 170), (90, 60, 20)]
+
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        # more ink colors than the smallest palette has
+        self.images = make_pages(self.tempdir.name, 2, colors=COLORS)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def get_options(self, profiles):
+        yaml, _ = write_options(self.tempdir.name,
+                                nworkers=1,
+                                num_colors=8,
+                                profiles=profiles)
+        parser = Options.get_argument_parser()
+        return Options(parser.parse_args([yaml] + self.images))
+
+    def run_job(self, options):
+        """run the pages through a PDFWorker in this process and hand the
+results to the builders."""
+        work_queue = queue.Queue()
+        for number, page in enumerate(options.pages):
+            work_queue.put(NumberedThing(number, page))
+        work_queue.put(None)
+        results_queue = queue.Queue()
+        PDFWorker(work_queue, results_queue, options)
+        builders = PDFBuilderThreads(options, len(options.pages))
+        while not results_queue.empty():
+            builders.put(results_queue.get())
+        builders.join()
+
+    def test_profiles(self):
+        import sklearn.cluster
+
+        options = self.get_options("""  archival:
+    general: {{pdfname: "{tempdir:s}/archival.pdf"}}
+  web:
+    general: {{pdfname: "{tempdir:s}/web.pdf", dpi: 50}}
+    noteshrink: {{num_colors: 4}}
+  small:
+    general: {{pdfname: "{tempdir:s}/small.pdf", output_dpi: 50}}
+""".format(tempdir=self.tempdir.name))
+        self.assertEqual(options.profiles["archival"].general.output_dpi, 100)
+        self.assertEqual(options.profiles["web"].general.output_dpi, 50)
+        self.assertEqual(options.profiles["web"].general.input_dpi, 100)
+
+        # count the k-means runs
+        fit = sklearn.cluster.MiniBatchKMeans.fit
+        nfits = []
+
+        def counting_fit(*args, **kwargs):
+            nfits.append(1)
+            return fit(*args, **kwargs)
+
+        sklearn.cluster.MiniBatchKMeans.fit = counting_fit
+        try:
+            self.run_job(options)
+        finally:
+            sklearn.cluster.MiniBatchKMeans.fit = fit
+        # archival and small share the palette with 8 colors
+        self.assertEqual(len(nfits), 2 * len(self.images))
+
+        for name, width, ncolors in (("archival", 400, 8), ("web", 200, 4),
+                                     ("small", 200, 8)):
+            pdfname = options.profiles[name].general.pdfname
+            reader = pdfrw.PdfReader(pdfname)
+            self.assertEqual(len(reader.pages), 2)
+            for page in reader.pages:
+                xobj = list(page.Resources.XObject.values())[0]
+                img = decode_image(xobj)
+                self.assertEqual(img.width, width)
+                colors = img.getcolors()
+                self.assertLessEqual(len(colors), ncolors)
+                self.assertGreater(len(colors), ncolors // 2)
+
+    def test_failed_builder(self):
+        # the second pdf can not be written, the first one is still done
+        options = self.get_options("""  good:
+    general: {{pdfname: "{tempdir:s}/good.pdf"}}
+  bad:
+    general: {{pdfname: "{tempdir:s}/missing/bad.pdf"}}
+""".format(tempdir=self.tempdir.name))
+        with self.assertRaisesRegex(RuntimeError, "profile bad"):
+            self.run_job(options)
+        reader = pdfrw.PdfReader(options.profiles["good"].general.pdfname)
+        self.assertEqual(len(reader.pages), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
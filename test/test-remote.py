@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+import unittest
+import multiprocessing.connection
+from pathlib import Path
+
+import pdfrw
+import img2pdf
+from PIL import Image
+
+DIR = Path(__file__).absolute().parent
+TOOLS = DIR.parent / "odp_tools"
+# the fake worker below unpickles the options
+sys.path.append(str(TOOLS))
+sys.path.insert(0, str(DIR.parent))
+
+from remote import read_page
+from test import make_pages
+from test import write_options
+
+AUTHKEY = "remote-test"
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def connect(port, authkey):
+    for _ in range(100):
+        try:
+            return multiprocessing.connection.Client(("127.0.0.1", port),
+                                                     authkey=authkey)
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    raise RuntimeError("coordinator did not start")
+
+
+class TestRemote(unittest.TestCase):
+    def test_localhost(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            yaml, pdfname = write_options(tempdir)
+            images = make_pages(tempdir, 5, widen=10)
+            address = "127.0.0.1:{:d}".format(get_free_port())
+            env = dict(os.environ, ODP_TOOLS_AUTHKEY=AUTHKEY)
+            coordinator = subprocess.Popen([
+                sys.executable,
+                str(TOOLS / "convert-scans"), "--listen", address, yaml
+            ] + images,
+                                           env=env,
+                                           stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.DEVNULL)
+            try:
+                port = int(address.split(":")[1])
+                # the wrong key is turned away
+                with self.assertRaises(multiprocessing.AuthenticationError):
+                    connect(port, b"wrong")
+                # a worker that takes pages and dies. its pages must be
+                # handed to the next worker.
+                conn = connect(port, AUTHKEY.encode())
+                conn.recv()
+                conn.recv()
+                conn.close()
+                worker = subprocess.Popen(
+                    [sys.executable,
+                     str(TOOLS / "convert-worker"), address],
+                    env=env)
+                self.assertEqual(coordinator.wait(timeout=300), 0)
+                self.assertEqual(worker.wait(timeout=60), 0)
+            finally:
+                coordinator.kill()
+
+            reader = pdfrw.PdfReader(pdfname)
+            widths = [float(page.MediaBox[2]) for page in reader.pages]
+            self.assertEqual(len(widths), 5)
+            self.assertEqual(widths, sorted(widths))
+
+    def test_lost_page(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            yaml, _ = write_options(tempdir)
+            images = make_pages(tempdir, 1)
+            address = "127.0.0.1:{:d}".format(get_free_port())
+            env = dict(os.environ, ODP_TOOLS_AUTHKEY=AUTHKEY)
+            coordinator = subprocess.Popen([
+                sys.executable,
+                str(TOOLS / "convert-scans"), "--listen", address,
+                "--task-timeout", "1", yaml
+            ] + images,
+                                           env=env,
+                                           stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.PIPE)
+            try:
+                port = int(address.split(":")[1])
+                # a worker that does not answer loses the page after the
+                # timeout, the next workers get it and die
+                silent = connect(port, AUTHKEY.encode())
+                silent.recv()
+                silent.recv()
+                for _ in range(2):
+                    conn = connect(port, AUTHKEY.encode())
+                    conn.recv()
+                    conn.recv()
+                    conn.close()
+                # the third lost worker ends the job
+                _, stderr = coordinator.communicate(timeout=60)
+                silent.close()
+            finally:
+                coordinator.kill()
+            self.assertNotEqual(coordinator.returncode, 0)
+            self.assertIn(images[0], stderr.decode())
+
+
+class TestReadPage(unittest.TestCase):
+    def test_read_page(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            jpeg = io.BytesIO()
+            Image.new("RGB", (80, 60), (10, 200, 30)).save(jpeg,
+                                                           format="JPEG")
+            pdf = str(Path(tempdir) / "scan.pdf")
+            with open(pdf, "wb") as f:
+                img2pdf.convert(jpeg.getvalue(), outputstream=f)
+            tiff = str(Path(tempdir) / "scan.tif")
+            imgs = [Image.new("RGB", (40, 30), c) for c in ("red", "blue")]
+            imgs[0].save(tiff, save_all=True, append_images=imgs[1:])
+
+            # the JPEG in the PDF is sent as it is
+            self.assertEqual(read_page(pdf, 0), jpeg.getvalue())
+            # TIFF frames become PNGs
+            data = read_page(tiff, 1)
+            self.assertEqual(data[:8], b"\x89PNG\r\n\x1a\n")
+            img = Image.open(io.BytesIO(data))
+            self.assertEqual(img.getpixel((0, 0)), (0, 0, 255))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import tempfile
+import subprocess
+import unittest
+import shutil
+from pathlib import Path
+
+DIR = Path(__file__).absolute().parent
+TOOLS = DIR.parent / "odp_tools"
+
+# modules that should never be loaded just to start one of the tools
+HEAVY = ["noteshrink", "sklearn", "numpy", "PIL", "img2pdf", "libxmp", "tqdm"]
+
+# generous upper bound for a run that only parses arguments
+MAX_STARTUP = 1.0
+
+
+def run_tool(*args):
+    cmd = [sys.executable] + [str(x) for x in args]
+    start = time.monotonic()
+    cp = subprocess.run(cmd, check=True, capture_output=True)
+    return cp, time.monotonic() - start
+
+
+class TestStartup(unittest.TestCase):
+    def test_help(self):
+        print("")
+        for tool in ("convert-scans", "convert-worker", "drop-pages",
+                     "make-comply", "merge-pdfs"):
+            _, elapsed = run_tool(TOOLS / tool, "--help")
+            print("{:s} --help: {:.3f}s".format(tool, elapsed))
+            self.assertLess(elapsed, MAX_STARTUP)
+
+    def test_noop_drop(self):
+        print("")
+        sample_path = DIR / "samples" / "drop.pdf"
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_path = Path(tempdir) / "sample.pdf"
+            shutil.copyfile(sample_path, pdf_path)
+            # page 99 does not exist, so this drops nothing
+            _, elapsed = run_tool(TOOLS / "drop-pages", "--no-metadata",
+                                  pdf_path, 99)
+            print("drop-pages no-op: {:.3f}s".format(elapsed))
+            self.assertLess(elapsed, MAX_STARTUP)
+
+    def test_no_heavy_imports(self):
+        code = ("import sys; import convert, pages, compliance, merge, remote; "
+                "print(' '.join(sys.modules))")
+        cp = subprocess.run([sys.executable, "-c", code],
+                            cwd=str(TOOLS),
+                            check=True,
+                            capture_output=True,
+                            text=True)
+        loaded = set(m.split(".")[0] for m in cp.stdout.split())
+        self.assertEqual(loaded & set(HEAVY), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import unittest
+import concurrent.futures
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+DIR = Path(__file__).absolute().parent
+sys.path.append(str(DIR.parent / "odp_tools"))
+
+from convert import PDFWorker
+from convert import PageImage
+from convert import TargetSearch
+
+
+def make_search(target_bytes, results):
+    search = TargetSearch(target_bytes, 25)
+    for size, psnr in results:
+        future = concurrent.futures.Future()
+        future.set_result((bytes(size), psnr))
+        search.candidates.append(future)
+    return search
+
+
+def make_text_page():
+    """dark glyphs, some of them red, on an off-white page."""
+    rng = np.random.RandomState(1)
+    pixels = np.full((500, 400, 3), 245, np.uint8)
+    for y in range(40, 460, 20):
+        for x in range(30, 370, 12):
+            if rng.rand() < 0.8:
+                color = (20, 20, 90) if rng.rand() < 0.8 else (180, 20, 20)
+                pixels[y:y + 10, x:x + 8] = color
+    return PageImage(100, image=Image.fromarray(pixels))
+
+
+def make_photo_page():
+    """a noisy color gradient over the whole page."""
+    rng = np.random.RandomState(2)
+    y, x = np.mgrid[0:500, 0:400]
+    pixels = np.stack([x * 255 / 400, y * 255 / 500, (x + y) * 255 / 900],
+                      axis=2)
+    pixels = pixels + rng.normal(0, 20, pixels.shape)
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    return PageImage(100, image=Image.fromarray(pixels))
+
+
+def make_profile(target_bytes):
+    profile = argparse.Namespace()
+    profile.general = argparse.Namespace(target_bytes_per_page=target_bytes,
+                                         min_psnr=20,
+                                         pipeline_depth=0,
+                                         output_dpi=100)
+    profile.noteshrink = argparse.Namespace(enable=True,
+                                            value_threshold=0.4,
+                                            sat_threshold=0.2,
+                                            num_colors=8,
+                                            sample_fraction=0.1,
+                                            saturate=True,
+                                            white_bg=False,
+                                            quiet=True,
+                                            kmeans_iter=5,
+                                            kmeans_batch_size=100)
+    profile.pngquant = argparse.Namespace(enable=False, max_quality=100)
+    profile.optipng = argparse.Namespace(enable=False)
+    profile.profiles = {"default": profile}
+    return profile
+
+
+def search(page, target_bytes):
+    """PDFWorker.search_work without the worker loop. with pipeline_depth 0
+the candidates are made right away."""
+    profile = make_profile(target_bytes)
+    worker = PDFWorker.__new__(PDFWorker)
+    worker.options = profile
+    return worker.search_work(page, profile, page, {})
+
+
+class TestTargetSearch(unittest.TestCase):
+    # (pdf size, psnr) of the candidates. the first one uses the settings of
+    # the profile.
+    results = [(300, 35.0), (200, 30.0), (100, 20.0), (250, 32.0)]
+
+    def test_best_under_target(self):
+        # 250 bytes has the better quality of the two that fit
+        search = make_search(260, self.results)
+        self.assertEqual(len(search.result()), 250)
+
+    def test_smallest_good(self):
+        # nothing that meets the quality floor fits, the 100 bytes candidate
+        # is too bad
+        search = make_search(150, self.results)
+        self.assertEqual(len(search.result()), 200)
+
+    def test_fallback(self):
+        search = make_search(150, [(300, 20.0), (200, 10.0)])
+        self.assertEqual(len(search.result()), 300)
+
+
+class TestSearchWork(unittest.TestCase):
+    def check_page(self, page, njpeg):
+        # 8, 4 and 2 colors, and JPEG for photos
+        results = [c.result() for c in search(page, 10**9).candidates]
+        self.assertEqual(len(results), 3 + njpeg)
+        jpegs = [b"/DCTDecode" in pdf for pdf, _ in results]
+        self.assertEqual(jpegs, [False] * 3 + [True] * njpeg)
+
+        # a budget that only the smallest good candidate fits
+        budget = min(len(pdf) for pdf, psnr in results if psnr >= 20)
+        pdf = search(page, budget).result()
+        self.assertLessEqual(len(pdf), budget)
+
+    def test_text(self):
+        self.check_page(make_text_page(), 0)
+
+    def test_photo(self):
+        self.check_page(make_photo_page(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()